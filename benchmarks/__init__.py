@@ -0,0 +1,434 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass, asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http import HTTPStatus
+from pathlib import Path
+from multiprocessing.connection import Connection
+import asyncio
+import random
+import re
+import resource
+import tempfile
+import threading
+import time
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+
+
+@dataclass
+class SiteConfig:
+    albums: int = 1
+    files_per_album: int = 100
+    file_size: int = 256 * 1024
+    # Seconds added before every response
+    latency: float = 0.0
+    # Fraction of requests answered with a 503
+    error_rate: float = 0.0
+    seed: int = 0
+    # Served by an asyncio server that also speaks cleartext HTTP/2
+    http2: bool = False
+
+
+@dataclass
+class BenchmarkResult:
+    engine: str
+    protocol: str
+    workers: int
+    wall_seconds: float
+    pages: int
+    files: int
+    bytes: int
+    failed_requests: int
+    cpu_seconds: float
+    peak_rss_mib: float
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.wall_seconds
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.wall_seconds
+
+    @property
+    def mib_per_second(self) -> float:
+        return self.bytes / 2**20 / self.wall_seconds
+
+
+class FakeBunkrContent:
+    """
+    Album pages, file pages and file contents with the same markup the bunkr
+    extractors look for. Contents are generated, so nothing is kept per file.
+    """
+
+    def __init__(self, config: SiteConfig) -> None:
+        self.config = config
+        self.thumbnail = b"\xff\xd8" + bytes(1024)
+        # Every file is its index followed by the same filler
+        self.filler = memoryview(bytes(range(256)) * (config.file_size // 256 + 1))[: config.file_size]
+        self.__random = random.Random(config.seed)
+        self.__lock = threading.Lock()
+
+    def should_fail(self) -> bool:
+        with self.__lock:
+            return self.__random.random() < self.config.error_rate
+
+    def file_chunks(self, file: int, start: int, end: int, chunk_size: int = 256 * 1024):
+        header = file.to_bytes(8, "big")[: self.config.file_size]
+        if start < len(header):
+            yield header[start : end + 1]
+            start = len(header)
+        for position in range(start, end + 1, chunk_size):
+            yield self.filler[position : min(position + chunk_size, end + 1)]
+
+    def respond(self, path: str, byte_range: str = "") -> Tuple[int, Dict[str, str], Iterable[bytes]]:
+        """
+        Status, headers and body chunks for a GET of path. The headers include
+        the Content-Type and the Content-Length.
+        """
+        config = self.config
+        if config.error_rate > 0 and self.should_fail():
+            return self.__page(503, b"Service unavailable", headers={"Retry-After": "0"})
+
+        match = re.fullmatch(r"/a/(\d+)", path)
+        if match is not None:
+            album = int(match.group(1))
+            first = album * config.files_per_album
+            links = "".join(
+                f'<a href="/f/{i}"><img src="/t/{i}.jpg"></a>'
+                for i in range(first, first + config.files_per_album)
+            )
+            return self.__page(200, f"<html><body><div>{links}</div></body></html>".encode())
+        match = re.fullmatch(r"/f/(\d+)", path)
+        if match is not None:
+            file = int(match.group(1))
+            return self.__page(
+                200,
+                f'<html><body><div class="lightgallery"><img src="/d/{file}.bin"></div></body></html>'.encode(),
+            )
+        match = re.fullmatch(r"/t/(\d+)\.jpg", path)
+        if match is not None:
+            return self.__page(200, self.thumbnail, "image/jpeg")
+        match = re.fullmatch(r"/d/(\d+)\.bin", path)
+        if match is not None:
+            return self.__file(int(match.group(1)), byte_range)
+        return self.__page(404, b"Not found")
+
+    @staticmethod
+    def __page(
+        status: int, body: bytes, content_type: str = "text/html", headers: Optional[dict] = None
+    ) -> Tuple[int, Dict[str, str], Iterable[bytes]]:
+        headers = dict(headers or {}, **{"Content-Type": content_type, "Content-Length": str(len(body))})
+        return status, headers, [body]
+
+    def __file(self, file: int, byte_range: str) -> Tuple[int, Dict[str, str], Iterable[bytes]]:
+        size = self.config.file_size
+        start, end = 0, size - 1
+        status = 200
+        headers = {"Accept-Ranges": "bytes", "ETag": f'"{file}-{size}"'}
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", byte_range)
+        if match is not None:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                return self.__page(416, b"", headers={"Content-Range": f"bytes */{size}"})
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Type"] = "application/octet-stream"
+        headers["Content-Length"] = str(end + 1 - start)
+        return status, headers, self.file_chunks(file, start, end)
+
+
+class FakeBunkrHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Without it small responses wait for the delayed ACK of the previous one
+    disable_nagle_algorithm = True
+    server: "FakeBunkrSite"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        if self.server.content.config.latency > 0:
+            time.sleep(self.server.content.config.latency)
+        status, headers, body = self.server.content.respond(self.path, self.headers.get("Range", ""))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            for chunk in body:
+                self.wfile.write(chunk)
+
+
+class FakeBunkrSite(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: SiteConfig, port: int = 0) -> None:
+        super(FakeBunkrSite, self).__init__(("127.0.0.1", port), FakeBunkrHandler)
+        self.content = FakeBunkrContent(config)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class AsyncFakeBunkrSite:
+    """
+    Serves the same content as FakeBunkrSite from an event loop, speaking
+    HTTP/1.1 or cleartext HTTP/2 (prior knowledge) on the same port. HTTP/2
+    requests are answered concurrently, every one on its own stream.
+    Requires h2.
+    """
+
+    def __init__(self, config: SiteConfig) -> None:
+        if h2 is None:
+            raise ImportError("The HTTP/2 site needs h2, install it with 'pip install h2'")
+        self.content = FakeBunkrContent(config)
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self, port: int = 0) -> None:
+        self.server = await asyncio.start_server(self.__handle, "127.0.0.1", port)
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            start = await reader.readexactly(len(H2_PREFACE))
+            if start == H2_PREFACE:
+                await self.__serve_http2(start, reader, writer)
+            else:
+                await self.__serve_http1(start, reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError, h2.exceptions.ProtocolError):
+            pass
+        finally:
+            writer.close()
+
+    async def __serve_http1(self, start: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        buffer = start
+        while True:
+            while b"\r\n\r\n" not in buffer:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    return
+                buffer += data
+            head, buffer = buffer.split(b"\r\n\r\n", 1)
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = request_line.split(" ", 2)
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if self.content.config.latency > 0:
+                await asyncio.sleep(self.content.config.latency)
+            status, response_headers, body = self.content.respond(path, headers.get("range", ""))
+            lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+            lines += [f"{name}: {value}" for name, value in response_headers.items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            if method != "HEAD":
+                for chunk in body:
+                    writer.write(chunk)
+                    await writer.drain()
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                return
+
+    async def __serve_http2(self, start: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        connection.initiate_connection()
+        # Woken up whenever the client grants more flow control window
+        window_updated = asyncio.Condition()
+        streams = set()
+
+        async def send(stream_id: int, method: str, path: str, byte_range: str) -> None:
+            if self.content.config.latency > 0:
+                await asyncio.sleep(self.content.config.latency)
+            status, headers, body = self.content.respond(path, byte_range)
+            response_headers = [(":status", str(status))] + [(name.lower(), value) for name, value in headers.items()]
+            try:
+                connection.send_headers(stream_id, response_headers, end_stream=method == "HEAD")
+                writer.write(connection.data_to_send())
+                if method == "HEAD":
+                    return
+                for chunk in body:
+                    chunk = memoryview(chunk)
+                    while len(chunk) > 0:
+                        async with window_updated:
+                            await window_updated.wait_for(lambda: connection.local_flow_control_window(stream_id) > 0)
+                        size = min(
+                            len(chunk), connection.local_flow_control_window(stream_id), connection.max_outbound_frame_size
+                        )
+                        connection.send_data(stream_id, bytes(chunk[:size]))
+                        chunk = chunk[size:]
+                        writer.write(connection.data_to_send())
+                        await writer.drain()
+                connection.end_stream(stream_id)
+                writer.write(connection.data_to_send())
+            except (h2.exceptions.StreamClosedError, ConnectionError):
+                # Reset by the client, or the connection is gone
+                pass
+
+        events = connection.receive_data(start)
+        writer.write(connection.data_to_send())
+        while True:
+            for event in events:
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    task = asyncio.create_task(
+                        send(event.stream_id, headers[":method"], headers[":path"], headers.get("range", ""))
+                    )
+                    streams.add(task)
+                    task.add_done_callback(streams.discard)
+                elif isinstance(event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)):
+                    async with window_updated:
+                        window_updated.notify_all()
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            writer.write(connection.data_to_send())
+            data = await reader.read(64 * 1024)
+            if not data:
+                return
+            events = connection.receive_data(data)
+
+
+def serve(config: SiteConfig, connection: Connection) -> None:
+    """
+    Runs the fake site until the parent closes `connection`, sending it the base url first.
+    """
+    if config.http2:
+        return asyncio.run(serve_async(config, connection))
+    site = FakeBunkrSite(config)
+    threading.Thread(target=site.serve_forever, daemon=True).start()
+    connection.send(site.base_url)
+    try:
+        connection.recv()
+    except EOFError:
+        pass
+    site.shutdown()
+
+
+async def serve_async(config: SiteConfig, connection: Connection) -> None:
+    site = AsyncFakeBunkrSite(config)
+    await site.start()
+    connection.send(site.base_url)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, connection.recv)
+    except EOFError:
+        pass
+    site.server.close()
+
+
+def run_case(
+    base_url: str,
+    album_urls: List[str],
+    workers: int,
+    output_dir: Optional[str],
+    connection: Connection,
+    engine: str = "threads",
+    protocol: str = "http1",
+) -> None:
+    """
+    Downloads every album with prepare_bunkr_scrapper and sends back a BenchmarkResult.
+    Runs in its own process, so the CPU time and peak RSS only belong to this case.
+    """
+    from searcher.download.bunkr import prepare_bunkr_scrapper
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as directory:
+        output_path = Path(directory)
+        scrapper = prepare_bunkr_scrapper(
+            "bench",
+            output_path,
+            None,
+            base_url=base_url,
+            max_workers=workers,
+            request_cooldown=0,
+            engine=engine,
+            http2=protocol == "h2",
+        )
+        started_at = time.perf_counter()
+        scrapper.run(album_urls)
+        wall_seconds = time.perf_counter() - started_at
+        pages, files, size, failed = count_metrics(scrapper.scrapping_info.metrics.snapshot())
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    connection.send(
+        BenchmarkResult(
+            engine=engine,
+            protocol=protocol,
+            workers=workers,
+            wall_seconds=wall_seconds,
+            pages=pages,
+            files=files,
+            bytes=size,
+            failed_requests=failed,
+            cpu_seconds=usage.ru_utime + usage.ru_stime,
+            # ru_maxrss is in KiB on Linux
+            peak_rss_mib=usage.ru_maxrss / 1024,
+        )
+    )
+
+
+def count_metrics(snapshot: dict) -> Tuple[int, int, int, int]:
+    """
+    Pages scanned, files downloaded, bytes downloaded and failed requests in
+    a MetricsRegistry snapshot of a run. Any 2xx is a success, so every range
+    of a segmented file counts as a download. HEAD size probes aren't counted.
+    """
+    counters = snapshot["counters"]
+    pages = files = size = failed = 0
+    for counter in counters:
+        labels = counter["labels"]
+        if counter["name"].endswith("_requests_total"):
+            if labels.get("method") == "HEAD":
+                continue
+            if not (labels["status"].isdigit() and labels["status"].startswith("2")):
+                failed += int(counter["value"])
+            elif labels["job"] == "Download files":
+                files += int(counter["value"])
+            else:
+                pages += int(counter["value"])
+        elif counter["name"].endswith("_bytes_total") and labels["job"] == "Download files":
+            size += int(counter["value"])
+    return pages, files, size, failed
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    header = f"{'engine':>8} {'protocol':>8} {'workers':>8} {'wall s':>8} {'pages/s':>9} {'files/s':>9} {'MiB/s':>9} {'CPU s':>8} {'RSS MiB':>8} {'failed':>7}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        lines.append(
+            f"{result.engine:>8} {result.protocol:>8} {result.workers:>8} {result.wall_seconds:>8.2f} {result.pages_per_second:>9.1f}"
+            f" {result.files_per_second:>9.1f} {result.mib_per_second:>9.1f}"
+            f" {result.cpu_seconds:>8.2f} {result.peak_rss_mib:>8.1f} {result.failed_requests:>7}"
+        )
+    return "\n".join(lines)
+
+
+def results_to_json(config: SiteConfig, results: List[BenchmarkResult]) -> dict:
+    return dict(
+        site=asdict(config),
+        results=[
+            dict(
+                asdict(result),
+                pages_per_second=result.pages_per_second,
+                files_per_second=result.files_per_second,
+                mib_per_second=result.mib_per_second,
+            )
+            for result in results
+        ],
+    )
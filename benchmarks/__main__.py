@@ -0,0 +1,73 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import itertools
+import json
+import multiprocessing
+
+from searcher.utils import parse_size_name
+from benchmarks import SiteConfig, serve, run_case, format_results, results_to_json
+
+
+def prepare_parser() -> ArgumentParser:
+    parser = ArgumentParser(description='Measures the bunkr scrapper against a local fake site')
+    parser.add_argument('-w','--workers',type=int,nargs='+',default=[1,4,8,16],help='Worker counts to benchmark')
+    parser.add_argument('-a','--albums',type=int,default=1,help='Albums to download in every run')
+    parser.add_argument('-n','--files',type=int,default=100,help='Files in every album')
+    parser.add_argument('-s','--file-size',type=str,default='256 KB',help='Size of every file (1 KB = 1024 B)')
+    parser.add_argument('--latency',type=float,default=0.0,help='Seconds the site waits before every response')
+    parser.add_argument('--error-rate',type=float,default=0.0,help='Fraction of requests answered with a 503')
+    parser.add_argument('-e','--engines',type=str,nargs='+',default=['threads'],choices=['threads','asyncio'],help='Engines to benchmark, asyncio needs aiohttp')
+    parser.add_argument('-P','--protocols',type=str,nargs='+',default=['http1'],choices=['http1','h2'],help='Protocols for the pages, h2 needs httpx[http2] and h2 and only runs with the threads engine')
+    parser.add_argument('-r','--repeat',type=int,default=1,help='Runs for every worker count')
+    parser.add_argument('--output-dir',type=str,help='Directory for the temporary downloads, the system temporary directory by default')
+    parser.add_argument('--json',type=str,help='Also writes the results to this file as JSON')
+    return parser
+
+
+def main():
+    args = prepare_parser().parse_args()
+    config = SiteConfig(
+        albums=args.albums,
+        files_per_album=args.files,
+        file_size=parse_size_name(args.file_size),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        # The asyncio site serves both protocols, so they are compared on the same server
+        http2='h2' in args.protocols,
+    )
+    # Every run gets a fresh interpreter, so resource usage is not carried between runs
+    context = multiprocessing.get_context('spawn')
+
+    site_connection, site_child = context.Pipe()
+    site = context.Process(target=serve, args=(config, site_child), daemon=True)
+    site.start()
+    base_url = site_connection.recv()
+    album_urls = [f'{base_url}/a/{album}' for album in range(config.albums)]
+    print(f'Fake site at {base_url}: {config.albums} album(s) of {config.files_per_album} files of {args.file_size}')
+
+    results = []
+    try:
+        for engine, protocol in itertools.product(args.engines, args.protocols):
+            if protocol == 'h2' and engine != 'threads':
+                print(f'Skipping {engine} over {protocol}, HTTP/2 only runs with the threads engine')
+                continue
+            for workers in args.workers:
+                for _ in range(args.repeat):
+                    connection, child = context.Pipe()
+                    case = context.Process(
+                        target=run_case, args=(base_url, album_urls, workers, args.output_dir, child, engine, protocol)
+                    )
+                    case.start()
+                    results.append(connection.recv())
+                    case.join()
+    finally:
+        site_connection.close()
+        site.join()
+
+    print(format_results(results))
+    if args.json is not None:
+        Path(args.json).write_text(json.dumps(results_to_json(config, results), indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from bs4 import BeautifulSoup
 from typing import List
 from dataclasses import dataclass
 
-def cook_soup(url):
+def cook_soup(url, html_parser='html.parser'):
     res = requests.get(
         url,
         headers={
@@ -14,7 +14,7 @@ def cook_soup(url):
         )
     if not res.ok:
         return None
-    return BeautifulSoup(res.content)
+    return BeautifulSoup(res.content, html_parser)
 
 def find_all_image_page_links(soup: BeautifulSoup) -> List[str]:
     links = []
@@ -1,35 +1,81 @@
 from io import TextIOWrapper
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
-from typing import List, Callable, Optional
+from typing import List, Callable, Optional, Iterable, Iterator, Tuple, Union
 import concurrent.futures
+import multiprocessing
 import requests
+import os
 import time
-from bs4 import BeautifulSoup
+import mmap
+import queue
+import threading
+from bs4 import BeautifulSoup, SoupStrainer
 from pathlib import Path
 from datetime import datetime
-from enum import Enum
+from contextlib import nullcontext
+from urllib.parse import urlsplit
 
-from scrapper.utils import NamedResource, ShowsProgress, check_response, HasStats
+from scrapper.utils import (
+    NamedResource,
+    ShowsProgress,
+    check_response,
+    HasStats,
+    resolve_html_parser,
+    content_range_start,
+    content_range_total,
+    hash_file,
+    RangeNotSupported,
+    rereadable,
+)
+from scrapper.network import PooledSession, MirrorPool
+from scrapper.limits import RateLimiter, ConcurrencyController, TokenBucket, ByteBudget, ByteBudgetExceeded
+from scrapper.scheduling import END_OF_STREAM, ClosableQueue, iter_completed, iter_queue, iter_by_size, RetryPolicy, SIZE_POLICIES
+from scrapper.storage import FileNameAllocator, ContentStore, PartialDownload, UrlSpool
+from scrapper.metrics import MetricsRegistry, MetricsExporter
+from scrapper.logs import LogLevel, LogSink, format_record
 
 
 @dataclass
 class ScrappingInfo:
     html_parser: str
     base_url: str
-    sparse_requests: bool
-    request_cooldown: float
     request_timeout: float
     max_workers: int
-    log_file: Optional[TextIOWrapper]
+    log_file: Optional[LogSink]
     request_headers: dict
+    session: requests.Session
+    rate_limiter: RateLimiter
+    metrics: MetricsRegistry
+    parse_executor: Optional[concurrent.futures.Executor] = None
+    # Workers shared with other Scrappers, every job uses its own pool if None
+    executor: Optional[concurrent.futures.Executor] = None
+    # Session for page requests, `session` is used if None
+    page_session: Optional[requests.Session] = None
+    # Interchangeable base urls, requests to one of them go to the best one
+    mirrors: Optional[MirrorPool] = None
 
 
-class LogLevel(Enum):
-    ERROR = "ERROR"
-    WARNING = "WARNING"
-    INFO = "INFO"
-    DEBUG = "DEBUG"
+def extract_urls(
+    job: Callable[[BeautifulSoup], List[str]],
+    parse_only: Optional[List[SoupStrainer]],
+    content: bytes,
+    html_parser: str,
+) -> List[str]:
+    """
+    Parses a page and runs the job extractor on it, trying every alternative in
+    parse_only until one succeeds. It is a module function so it can run in a
+    worker process, the job must be a module level function too.
+    """
+    if not parse_only:
+        return job(BeautifulSoup(content, html_parser))
+    for index, strainer in enumerate(parse_only):
+        page_soup = BeautifulSoup(content, html_parser, parse_only=strainer)
+        try:
+            return job(page_soup)
+        except Exception:
+            if index == len(parse_only) - 1:
+                raise
 
 
 class ScrappingJob(ABC, NamedResource):
@@ -40,14 +86,17 @@ class ScrappingJob(ABC, NamedResource):
             super(ScrappingJob, self).__init__()
 
     def __format_msg(self, lvl: LogLevel, msg: str) -> str:
-        return f"{lvl.value}: {self.get_name()} - {datetime.now().isoformat()}| {msg}"
+        return format_record(lvl, self.get_name(), datetime.now(), msg)
 
     def print_statement(
         self,
         msg: str,
         lvl: LogLevel = LogLevel.INFO,
-        file: Optional[TextIOWrapper] = None,
+        file: Union[LogSink, TextIOWrapper, None] = None,
     ):
+        if isinstance(file, LogSink):
+            file.submit(lvl, self.get_name(), msg, echo=True)
+            return
         formatted_msg = self.__format_msg(lvl, msg)
         if file is not None:
             print(formatted_msg, file=file, flush=True)
@@ -57,18 +106,78 @@ class ScrappingJob(ABC, NamedResource):
         self,
         msg: str,
         lvl: LogLevel = LogLevel.INFO,
-        file: Optional[TextIOWrapper] = None,
+        file: Union[LogSink, TextIOWrapper, None] = None,
     ):
+        if isinstance(file, LogSink):
+            file.submit(lvl, self.get_name(), msg)
+            return
         formatted_msg = self.__format_msg(lvl, msg)
         if file is not None:
             print(formatted_msg, file=file)
 
+    def request(self, url: str, info: ScrappingInfo, method: str = "GET", **kwargs) -> requests.Response:
+        """
+        Rate limited request through the shared session, recorded in the metrics.
+        Urls on a mirror are sent to the best mirror of info.mirrors.
+        The transfer of streamed bodies has to be recorded by the caller.
+        """
+        mirror = None
+        if info.mirrors is not None:
+            url, mirror = info.mirrors.resolve(url)
+        labels = dict(job=self.get_name(), host=urlsplit(url).netloc)
+        with info.metrics.timer("rate_limit_wait_seconds", **labels):
+            info.rate_limiter.acquire(url)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_session(info).request(method, url, **kwargs)
+        except requests.RequestException as e:
+            info.metrics.increment("requests_total", method=method, status=e.__class__.__name__, **labels)
+            if mirror is not None:
+                info.mirrors.record(mirror, None, None, url)
+            raise
+        info.metrics.increment("requests_total", method=method, status=response.status_code, **labels)
+        ttfb = response.elapsed.total_seconds()
+        if mirror is not None:
+            info.mirrors.record(mirror, ttfb, response.status_code, url)
+        info.metrics.observe("request_seconds", ttfb, phase="ttfb", **labels)
+        if not kwargs.get("stream", False):
+            self.record_transfer(url, info, time.perf_counter() - started_at - ttfb, len(response.content))
+        return response
+
+    def record_transfer(self, url: str, info: ScrappingInfo, seconds: float, size: int) -> None:
+        labels = dict(job=self.get_name(), host=urlsplit(url).netloc)
+        info.metrics.observe("request_seconds", max(0.0, seconds), phase="transfer", **labels)
+        info.metrics.increment("bytes_total", size, **labels)
+
+    def get_session(self, info: ScrappingInfo) -> requests.Session:
+        return info.session
+
+    def worker_pool(self, info: ScrappingInfo, max_workers: int):
+        """
+        Executor for the job requests: the shared one if there is one, which is
+        left open, otherwise a new pool of max_workers threads.
+        """
+        if info.executor is not None:
+            return nullcontext(info.executor)
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
     @abstractmethod
     def execute(self, urls: List[str], info: ScrappingInfo):
         pass
 
+    def stream(
+        self, urls: Iterable[str], emit: Callable[[str], None], info: ScrappingInfo
+    ) -> None:
+        """
+        Pipelined version of execute: consumes urls as they are produced by the
+        previous job and calls emit for every output url as soon as it is available.
+        By default it waits for the whole input and runs execute.
+        """
+        for url in self.execute(list(urls), info):
+            emit(url)
+
     @abstractmethod
-    def on_exit(self, log_file: Optional[TextIOWrapper]) -> None:
+    def on_exit(self, log_file: Optional[LogSink]) -> None:
         pass
 
 
@@ -81,94 +190,210 @@ class URLScrapper(ScrappingJob, ShowsProgress, HasStats):
         self.base_description = kwargs.get("description", "Scrapping urls")
         # Job
         self.job = job
+        # Alternatives declared with parses_only, None parses the whole page
+        self.parse_only: Optional[List[SoupStrainer]] = kwargs.get(
+            "parse_only", getattr(job, "parse_only", None)
+        )
+        self.retry_policy: RetryPolicy = kwargs.get("retry_policy", RetryPolicy())
+        # Adapts the requests in flight between its bounds, a fixed amount of workers if None
+        self.concurrency: Optional[ConcurrencyController] = kwargs.get("concurrency")
+        # When set, execute writes the links found to a temporary file in spool_dir
+        # instead of keeping them in memory
+        self.spool_results: bool = kwargs.get("spool_results", False)
+        self.spool_dir: Optional[str] = kwargs.get("spool_dir")
+        self.found_len = 0
+        # Links are also counted from the thread reading the input while streaming
+        self.__found_lock = threading.Lock()
+
+    def get_session(self, info: ScrappingInfo) -> requests.Session:
+        return info.page_session if info.page_session is not None else info.session
+
+    def __extract(self, content: bytes, info: ScrappingInfo) -> List[str]:
+        if info.parse_executor is None:
+            return extract_urls(self.job, self.parse_only, content, info.html_parser)
+        # Only the page bytes go to the parsing process and only the urls come back
+        return info.parse_executor.submit(
+            extract_urls, self.job, self.parse_only, content, info.html_parser
+        ).result()
 
     def get_urls(self, url: str, info: ScrappingInfo) -> Optional[List[str]]:
+        """
+        Returns None if the page failed, retryable errors are raised for the caller to reschedule.
+        """
         try:
-            super().advance_progress()
-
-            response = requests.get(
-                url,
-                timeout=info.request_timeout,
-                headers=info.request_headers,
-            )
+            response = self.request(url, info, timeout=info.request_timeout)
             check_response(response)
 
-            # TODO: orchestrate waits for requests
-            if info.sparse_requests:
-                time.sleep(info.request_cooldown)
+            with info.metrics.timer("parse_seconds", job=self.get_name()):
+                urls = self.__extract(response.content, info)
 
-            page_soup = BeautifulSoup(response.text, info.html_parser)
-            urls = self.job(page_soup)
+            return self.complete_urls(urls, info)
+        except Exception as e:
+            if self.retry_policy.is_retryable(e):
+                raise
+            super().add_fail()
+            super().log_statement(
+                f"Failed job for {url}: {e}", LogLevel.ERROR, info.log_file
+            )
+            return None
+
+    @staticmethod
+    def complete_urls(urls: List[str], info: ScrappingInfo) -> List[str]:
+        return [(info.base_url + u) if not u.startswith("http") else u for u in urls]
 
-            def complete_url(u: str) -> str:
-                return (info.base_url + u) if not u.startswith("http") else u
+    def __get_urls_retrying(self, url: str, info: ScrappingInfo) -> Optional[List[str]]:
+        """
+        Sequential version of the retries done by iter_completed.
+        """
+        attempt = 1
+        while True:
+            try:
+                return self.get_urls(url, info)
+            except Exception as e:
+                delay = self.retry_policy.next_delay(attempt, e)
+                if delay is None:
+                    super().add_fail()
+                    super().log_statement(
+                        f"Failed job for {url}: {e}", LogLevel.ERROR, info.log_file
+                    )
+                    return None
+                time.sleep(delay)
+                attempt += 1
 
-            return list(map(complete_url, urls))
+    def _handle_result(
+        self, url: str, future: concurrent.futures.Future, info: ScrappingInfo
+    ) -> List[str]:
+        super().advance_progress()
+        if self.concurrency is not None:
+            self.stats["concurrency_limit"] = self.concurrency.limit
+        try:
+            data: Optional[List[str]] = future.result()
         except Exception as e:
             super().add_fail()
             super().log_statement(
-                f"Failed job for {url}: {e}", LogLevel.ERROR, info.log_file
+                f"Could not search in url {url}: {e}", LogLevel.ERROR, info.log_file
             )
+            self.add_stat(url, False)
+            return []
+        if data is None:
+            self.add_stat(url, False)
+            return []
+        self.add_stat(url, True, data)
+        return data
+
+    def _found_links(self, url: str) -> Optional[List[str]]:
+        """
+        Links found for url in a previous run, or None if it has to be scanned.
+        """
+        if not self.is_processed(url):
             return None
+        return self.get_outputs(url)
 
-    def execute(self, urls: List[str], info: ScrappingInfo):
-        output_links = []
-        future_to_url = {}
-        if self.get_stats()['fails'] > 0:
-            urls = self.get_failed_urls()
-            self.remove_failed_urls()
-        elif self.get_stats()['tries'] > 0:
-            urls = self.get_all_urls()
-            self.found_len = len(urls)
-            return urls
+    def _count_found(self, amount: int) -> None:
+        with self.__found_lock:
+            self.found_len += amount
 
-        super().init_progress_bar(len(urls), self.base_description)
+    def _pending_pages(self, urls: Iterable[str], emit: Callable[[str], None]) -> Iterator[str]:
+        """
+        Yields the urls to scan, emitting right away the links found for the others in a previous run.
+        """
+        for url in urls:
+            found = self._found_links(url)
+            if found is None:
+                yield url
+                continue
+            self._count_found(len(found))
+            for link in found:
+                emit(link)
 
-        if len(urls) < 10:
-            for url in urls:
+    def stream(
+        self, urls: Iterable[str], emit: Callable[[str], None], info: ScrappingInfo
+    ) -> None:
+        super().init_progress_bar(0, self.base_description)
+        self.found_len = 0
+        with self.worker_pool(
+            info, self.concurrency.max_limit if self.concurrency is not None else info.max_workers
+        ) as executor:
+            for url, future in iter_completed(
+                executor,
+                lambda u: self.get_urls(u, info),
+                self.count_progress_total(self._pending_pages(urls, emit)),
+                info.max_workers * 2,
+                self.retry_policy,
+                self.concurrency,
+            ):
+                links = self._handle_result(url, future, info)
+                self._count_found(len(links))
+                for link in links:
+                    emit(link)
+        super().clear_progress_bar()
+
+    def _scan_previous(
+        self, urls: Iterable[str], info: ScrappingInfo
+    ) -> Tuple[Union[UrlSpool, List[str]], int]:
+        """
+        Collects the links found in a previous run and counts the pages still to be scanned.
+        """
+        output_links = UrlSpool(self.spool_dir) if self.spool_results else []
+        pending_count = 0
+        total = 0
+        for url in urls:
+            total += 1
+            found = self._found_links(url)
+            if found is None:
+                pending_count += 1
+            else:
+                output_links.extend(found)
+        if pending_count < total:
+            self.print_statement(
+                f"{total - pending_count} pages already scanned, skipping them",
+                LogLevel.INFO,
+                info.log_file,
+            )
+        return output_links, pending_count
+
+    def execute(self, urls: Iterable[str], info: ScrappingInfo):
+        """
+        urls is read twice, one-shot iterators are read into a list first, a
+        UrlSpool keeps a long input out of memory. Only a window of pages is in flight at any time.
+        """
+        urls = rereadable(urls)
+        output_links, pending_count = self._scan_previous(urls, info)
+        pending_urls = (url for url in urls if not self.is_processed(url))
+
+        super().init_progress_bar(pending_count, self.base_description)
+
+        if pending_count < 10:
+            for url in pending_urls:
                 super().advance_progress()
-                res = self.get_urls(url, info)
+                res = self.__get_urls_retrying(url, info)
                 if res is not None:
-                    self.add_stat(url, True)
+                    self.add_stat(url, True, res)
                     output_links.extend(res)
                 else:
                     self.add_stat(url, False)
+            super().clear_progress_bar()
             self.found_len = len(output_links)
             return output_links
 
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=info.max_workers
+        with self.worker_pool(
+            info, self.concurrency.max_limit if self.concurrency is not None else info.max_workers
         ) as executor:
-            for url in urls:
-                try:
-                    future_to_url.update(
-                        {executor.submit(self.get_urls, url, info): url}
-                    )
-                except Exception:
-                    super().add_fail()
-
-        for future in concurrent.futures.as_completed(future_to_url):
-            url = future_to_url[future]
-
-            try:
-                data: Optional[List[str]] = future.result()
-            except Exception as e:
-                super().log_statement(
-                    f"Could not search in url {url}: {e}", LogLevel.ERROR, info.log_file
-                )
-                self.add_stat(url, False)
-            else:
-                if data is not None:
-                    self.add_stat(url, True)
-                    output_links.extend(data)
-                else:
-                    self.add_stat(url, False)
+            for url, future in iter_completed(
+                executor,
+                lambda u: self.get_urls(u, info),
+                pending_urls,
+                info.max_workers * 2,
+                self.retry_policy,
+                self.concurrency,
+            ):
+                output_links.extend(self._handle_result(url, future, info))
 
         super().clear_progress_bar()
         self.found_len = len(output_links)
         return output_links
 
-    def on_exit(self, log_file: Optional[TextIOWrapper]) -> None:
+    def on_exit(self, log_file: Optional[LogSink]) -> None:
         tries = self.stats["tries"]
         fails = self.stats["fails"]
         super().print_statement(
@@ -208,7 +433,7 @@ class URLProcessor(ScrappingJob):
         )
         return urls
 
-    def on_exit(self, log_file: Optional[TextIOWrapper]) -> None:
+    def on_exit(self, log_file: Optional[LogSink]) -> None:
         pass
 
 
@@ -224,89 +449,493 @@ class FileDownloader(ScrappingJob, ShowsProgress, HasStats):
         self.excluded_file_extensions: List[str] = kwargs.get('excluded_file_extensions', [])
 
         self.append_files = kwargs.get("append_files", True)
+        # Streaming keeps at most `buffer_size` bytes of a file in memory per worker
+        self.stream_downloads: bool = kwargs.get("stream", True)
+        self.buffer_size: int = kwargs.get("buffer_size", 64 * 1024)
+        self.partial_suffix: str = kwargs.get("partial_suffix", ".part")
+        # Keep partial files of failed downloads to continue them with a Range request,
+        # later runs only find them again with save_stats
+        self.resume_downloads: bool = kwargs.get("resume_downloads", True)
+        # Shared between downloaders to avoid storing the same file twice
+        self.content_store: Optional[ContentStore] = kwargs.get("content_store")
+        # Files of at least `segment_threshold` bytes are fetched as `segments` parallel ranges
+        self.segments: int = kwargs.get("segments", 1)
+        self.segment_threshold: int = kwargs.get("segment_threshold", 64 * 2**20)
+        # Connection budget for segments, shared by all the workers of the downloader
+        self.segment_connections: int = kwargs.get("segment_connections", 8)
+        self.use_mmap: bool = kwargs.get("use_mmap", False)
+        self.retry_policy: RetryPolicy = kwargs.get("retry_policy", RetryPolicy())
+        # Adapts the requests in flight between its bounds, a fixed amount of workers if None
+        self.concurrency: Optional[ConcurrencyController] = kwargs.get("concurrency")
+        # Bytes per second shared by every worker, and by every downloader given the same bucket
+        self.bandwidth_limiter: Optional[TokenBucket] = kwargs.get("bandwidth_limiter")
+        self.byte_budget: Optional[ByteBudget] = kwargs.get("byte_budget")
+        # "smallest", "largest" or "interleave" reorders upcoming files by the size
+        # announced on a HEAD request, None keeps the page order
+        self.size_policy: Optional[str] = kwargs.get("size_policy")
+        if self.size_policy is not None and self.size_policy not in SIZE_POLICIES:
+            raise ValueError(f"Unknown size policy {self.size_policy}, expected one of {SIZE_POLICIES}")
+        self.size_lookahead: int = kwargs.get("size_lookahead", 64)
+        self.__segment_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.__segment_executor_lock = threading.Lock()
+
+    def __get_segment_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self.__segment_executor_lock:
+            if self.__segment_executor is None:
+                self.__segment_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.segment_connections
+                )
+            return self.__segment_executor
+
+    def __throttle(self, amount: int, reserved: bool) -> None:
+        """
+        Paces received bytes to the bandwidth limit, and charges them to the
+        byte budget unless the whole file was reserved in advance.
+        """
+        if self.bandwidth_limiter is not None:
+            self.bandwidth_limiter.acquire(amount)
+        if self.byte_budget is not None and not reserved:
+            self.byte_budget.consume(amount)
+
+    def _reserve(self, size: Optional[int]) -> int:
+        """
+        Reserves size bytes of the byte budget, returns the amount reserved.
+        """
+        if self.byte_budget is None or size is None:
+            return 0
+        self.byte_budget.reserve(size)
+        return size
+
+    @staticmethod
+    def __completed_bytes(partial: PartialDownload) -> int:
+        if partial.completed_segments is None:
+            return 0
+        return sum(end - start + 1 for start, end in partial.completed_segments)
+
+    def __can_segment(self, response: requests.Response, size: Optional[int]) -> bool:
+        return (
+            self.segments > 1
+            and size is not None
+            and size >= self.segment_threshold
+            and response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        )
+
+    def __fetch_segment(
+        self,
+        url: str,
+        partial: PartialDownload,
+        start: int,
+        end: int,
+        target: Optional[mmap.mmap],
+        info: ScrappingInfo,
+    ) -> None:
+        headers = partial.range_headers(start)
+        headers["Range"] = f"bytes={start}-{end}"
+        position = start
+        with self.request(
+            url, info, timeout=self.file_download_timeout, stream=True, headers=headers
+        ) as response:
+            check_response(response)
+            if response.status_code != 206 or content_range_start(response) != start:
+                raise RangeNotSupported(f"Range {start}-{end} not honored for {url}")
+            transfer_started_at = time.perf_counter()
+            disk_seconds = 0.0
+            with open(partial.tmp_path, "r+b") if target is None else nullcontext() as f:
+                if f is not None:
+                    f.seek(start)
+                for chunk in response.iter_content(chunk_size=self.buffer_size):
+                    chunk = chunk[: end + 1 - position]
+                    self.__throttle(len(chunk), True)
+                    write_started_at = time.perf_counter()
+                    if target is not None:
+                        target[position : position + len(chunk)] = chunk
+                    else:
+                        f.write(chunk)
+                    disk_seconds += time.perf_counter() - write_started_at
+                    position += len(chunk)
+            self.record_transfer(
+                url, info, time.perf_counter() - transfer_started_at - disk_seconds, position - start
+            )
+            info.metrics.observe("disk_write_seconds", disk_seconds, job=self.get_name())
+        if position != end + 1:
+            raise Exception(f"Segment {start}-{end} of {url} ended after {position - start} bytes")
+        partial.complete_segment(start, end)
+
+    def __download_segments(
+        self, url: str, path: str, partial: PartialDownload, size: int, info: ScrappingInfo
+    ) -> None:
+        """
+        Fetches the file as parallel byte ranges written into a preallocated partial
+        file, which is committed once every segment got exactly its size.
+        """
+        partial.start_segments(size)
+        completed = set(partial.completed_segments)
+        segment_size = -(-size // self.segments)
+        ranges = [
+            (start, min(start + segment_size, size) - 1)
+            for start in range(0, size, segment_size)
+        ]
+        with open(partial.tmp_path, "r+b" if os.path.exists(partial.tmp_path) else "wb") as f:
+            f.truncate(size)
+        partial.save(sum(end - start + 1 for start, end in completed))
+
+        with open(partial.tmp_path, "r+b") as f:
+            target = mmap.mmap(f.fileno(), size) if self.use_mmap else None
+            try:
+                executor = self.__get_segment_executor()
+                futures = [
+                    executor.submit(self.__fetch_segment, url, partial, start, end, target, info)
+                    for start, end in ranges
+                    if (start, end) not in completed
+                ]
+                # Every segment must be done before the mapping is closed
+                concurrent.futures.wait(futures)
+                if target is not None:
+                    target.flush()
+            finally:
+                if target is not None:
+                    target.close()
+        for future in futures:
+            error = future.exception()
+            if isinstance(error, RangeNotSupported):
+                # The file changed or the server stopped honoring ranges, start over next time
+                partial.discard()
+            if error is not None:
+                raise error
+
+        digest = None
+        if self.content_store is not None:
+            hasher = self.content_store.new_hash()
+            hash_file(hasher, partial.tmp_path, self.buffer_size)
+            digest = hasher.hexdigest()
+        self._commit_file(url, digest, size, partial.tmp_path, path)
+        partial.finish()
+
+    def _reuse_stored(self, url: str, size: Optional[int], path: str) -> bool:
+        """
+        Places a previously downloaded copy of url at path, if there is one.
+        """
+        if self.content_store is None:
+            return False
+        stored_path = self.content_store.find(url, size)
+        return stored_path is not None and self.content_store.place(stored_path, path)
+
+    def _commit_file(self, url: str, digest: Optional[str], size: int, tmp_path: str, path: str) -> None:
+        if self.content_store is None or digest is None:
+            os.replace(tmp_path, path)
+            return
+        stored_path = self.content_store.find_digest(digest)
+        if stored_path is not None and self.content_store.place(stored_path, path):
+            os.remove(tmp_path)
+            self.content_store.add(url, digest, size)
+            return
+        os.replace(tmp_path, path)
+        self.content_store.add(url, digest, size, path)
+
+    def __stream_to_file(self, url: str, path: str, info: ScrappingInfo) -> None:
+        """
+        Writes the response body in chunks to a temporary file next to `path`
+        and moves it into place only once the whole body has been received.
+        A partial file left by a previous attempt is continued with a Range
+        request, or downloaded again if the server doesn't honor it.
+        """
+        partial = PartialDownload(path, url, self.partial_suffix)
+        offset = partial.load() if self.resume_downloads else 0
+        hasher = self.content_store.new_hash() if self.content_store is not None else None
+        received = offset
+        reserved = 0
+        segmented = False
+        # Bytes of the segments completed by previous attempts
+        completed = 0
+        try:
+            if partial.completed_segments is not None:
+                if self.segments > 1:
+                    segmented = True
+                    completed = self.__completed_bytes(partial)
+                    reserved = self._reserve(partial.size - completed)
+                    return self.__download_segments(url, path, partial, partial.size, info)
+                partial.completed_segments = None
+            with self.request(
+                url,
+                info,
+                timeout=self.file_download_timeout,
+                stream=True,
+                headers=partial.range_headers(offset) if offset > 0 else None,
+            ) as response:
+                if response.status_code == 416 and offset > 0 and content_range_total(response) == offset:
+                    # The previous attempt already received the whole file
+                    received = offset
+                    if hasher is not None:
+                        hash_file(hasher, partial.tmp_path, self.buffer_size)
+                else:
+                    check_response(response)
+                    if offset > 0 and (response.status_code != 206 or content_range_start(response) != offset):
+                        offset = 0
+                    partial.etag = response.headers.get("ETag")
+                    partial.last_modified = response.headers.get("Last-Modified")
+                    total_size = content_range_total(response) if offset > 0 else None
+                    if total_size is None and response.headers.get("Content-Length") is not None:
+                        total_size = int(response.headers["Content-Length"])
+                    if self._reuse_stored(url, total_size, path):
+                        partial.discard()
+                        return
+                    reserved = self._reserve(total_size - offset if total_size is not None else None)
+                    segmented = offset == 0 and self.__can_segment(response, total_size)
+                    if not segmented:
+                        if self.resume_downloads:
+                            partial.save(offset)
+                        received = offset
+                        if hasher is not None and offset > 0:
+                            hash_file(hasher, partial.tmp_path, self.buffer_size)
+                        transfer_started_at = time.perf_counter()
+                        disk_seconds = 0.0
+                        with open(partial.tmp_path, "ab" if offset > 0 else "wb") as f:
+                            for chunk in response.iter_content(chunk_size=self.buffer_size):
+                                self.__throttle(len(chunk), reserved > 0)
+                                write_started_at = time.perf_counter()
+                                f.write(chunk)
+                                disk_seconds += time.perf_counter() - write_started_at
+                                received += len(chunk)
+                                if hasher is not None:
+                                    hasher.update(chunk)
+                        self.record_transfer(
+                            url, info, time.perf_counter() - transfer_started_at - disk_seconds, received - offset
+                        )
+                        info.metrics.observe("disk_write_seconds", disk_seconds, job=self.get_name())
+            if segmented:
+                # The body of the probe response is never read, its connection is just dropped
+                return self.__download_segments(url, path, partial, total_size, info)
+            self._commit_file(url, hasher.hexdigest() if hasher is not None else None, received, partial.tmp_path, path)
+            partial.finish()
+        except BaseException:
+            if reserved > 0:
+                # Segments completed in this attempt keep their part of the reservation
+                used = self.__completed_bytes(partial) - completed if segmented else received - offset
+                self.byte_budget.release(max(0, reserved - used))
+            if not self.resume_downloads:
+                partial.discard()
+            elif os.path.exists(partial.tmp_path):
+                partial.save(received)
+            raise
 
     def __download_image(self, url: str, path: str, info: ScrappingInfo) -> bool:
         try:
-            if info.sparse_requests:
-                time.sleep(info.request_cooldown)
-            super().advance_progress()
-            response = requests.get(
-                url, timeout=self.file_download_timeout, headers=info.request_headers
-            )
-            check_response(response)
+            if self._reuse_stored(url, None, path):
+                return True
+            if self.byte_budget is not None and self.byte_budget.closed:
+                raise ByteBudgetExceeded(f"Byte budget reached, skipping {url}")
+            if self.stream_downloads:
+                self.__stream_to_file(url, path, info)
+            else:
+                response = self.request(url, info, timeout=self.file_download_timeout)
+                check_response(response)
+                self.__throttle(len(response.content), False)
 
-            with open(path, "wb") as f:
-                f.write(response.content)
+                tmp_path = path + self.partial_suffix
+                with info.metrics.timer("disk_write_seconds", job=self.get_name()):
+                    with open(tmp_path, "wb") as f:
+                        f.write(response.content)
+                digest = None
+                if self.content_store is not None:
+                    hasher = self.content_store.new_hash()
+                    hasher.update(response.content)
+                    digest = hasher.hexdigest()
+                self._commit_file(url, digest, len(response.content), tmp_path, path)
+        except ByteBudgetExceeded as ex:
+            # Not a failure of the file, it stays pending for a later run
+            super().log_statement(ex, LogLevel.WARNING, info.log_file)
+            return False
         except Exception as ex:
+            if self.retry_policy.is_retryable(ex):
+                raise
             super().log_statement(ex, LogLevel.ERROR, info.log_file)
             super().add_fail()
             return False
         else:
             return True
 
-    def execute(self, urls: List[str], info: ScrappingInfo):
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=info.max_workers
-        ) as executor:
-            future_to_url = {}
-            
-            if self.get_stats()['fails'] > 0:
-                print('Retrying failed urls')
-                urls = self.get_failed_urls()
-                self.remove_failed_urls()
-            elif self.get_stats()['tries'] > 0:
-                print('There are no failures. Continuing...')
-                urls = self.get_all_urls()
-                return urls
-            
-            super().print_statement(
-                f"Fetching {len(urls)} files", LogLevel.INFO, info.log_file
+    def __probe_size(self, url: str, info: ScrappingInfo) -> Optional[int]:
+        """
+        Size announced by the server for url, None if it can't be known.
+        """
+        try:
+            with self.request(url, info, "HEAD", timeout=info.request_timeout, allow_redirects=True) as response:
+                length = response.headers.get("Content-Length", "")
+                return int(length) if response.ok and length.isdigit() else None
+        except requests.RequestException:
+            return None
+
+    def __by_size(
+        self, downloads: Iterable[Tuple[str, str]], executor: concurrent.futures.Executor, info: ScrappingInfo
+    ) -> Iterable[Tuple[str, str]]:
+        if self.size_policy is None:
+            return downloads
+        return iter_by_size(
+            downloads,
+            lambda d: self.__probe_size(d[0], info),
+            self.size_policy,
+            self.size_lookahead,
+            executor,
+        )
+
+    def __resumable_path(self, url: str) -> Optional[str]:
+        """
+        Path used by a previous failed attempt to download url, if its partial file is still there.
+        """
+        if not self.resume_downloads or self.is_processed(url):
+            return None
+        outputs = self.get_outputs(url)
+        if not outputs or not os.path.exists(outputs[0] + self.partial_suffix):
+            return None
+        return outputs[0]
+
+    def __file_path(
+        self, allocator: FileNameAllocator, index: int, image: str, info: ScrappingInfo
+    ) -> Optional[str]:
+        """
+        Returns the path the file will be saved to, or None if it must be skipped.
+        """
+        previous_path = self.__resumable_path(image)
+        if previous_path is not None:
+            return previous_path
+        file_extension: str = image.split(".")[-1]
+        if file_extension is None or file_extension == image or file_extension == '' or len(file_extension) > 4:
+            super().print_statement(f"Unknown file type for {image}", LogLevel.WARNING, info.log_file)
+            file_extension = "jpg"
+        if file_extension in self.excluded_file_extensions:
+            super().print_statement(f"{file_extension} file extension found. Skipping.", LogLevel.DEBUG, info.log_file)
+            return None
+        image_path = allocator.allocate(index, file_extension.lower())
+        return image_path
+
+    def _handle_result(
+        self, url: str, path: str, future: concurrent.futures.Future, info: ScrappingInfo
+    ) -> bool:
+        super().advance_progress()
+        if self.concurrency is not None:
+            self.stats["concurrency_limit"] = self.concurrency.limit
+        try:
+            res: bool = future.result()
+            self.add_stat(url, res, [path])
+            if not res:
+                self.__drop_unresumable(url, path)
+            return True
+        except Exception as ex:
+            super().add_fail()
+            super().log_statement(
+                f"Could not download image for {url}: {ex}",
+                LogLevel.ERROR,
+                info.log_file,
             )
-            super().init_progress_bar(len(urls), self.base_description)
+            self.add_stat(url, False, [path])
+            self.__drop_unresumable(url, path)
+            return False
+
+    def __drop_unresumable(self, url: str, path: str) -> None:
+        """
+        Removes the partial file of a failed download unless a later run can find
+        it again, which needs the saved stats to map the url to its path.
+        """
+        if not self.save_stats:
+            PartialDownload(path, url, self.partial_suffix).discard()
 
-            index_offset = 0
+    def _stream_downloads(self, urls: Iterable[str], info: ScrappingInfo) -> Iterator[Tuple[str, str]]:
+        """
+        (url, path) of the files to download as urls arrive, growing the progress bar total.
+        """
+        allocator = FileNameAllocator(self.directory, self.base_name, self.append_files)
+        for index, image in enumerate(urls):
+            if self.byte_budget is not None and self.byte_budget.closed:
+                self.print_statement(
+                    "Byte budget reached, no more files will be downloaded", LogLevel.WARNING, info.log_file
+                )
+                return
+            if self.is_processed(image):
+                continue
+            self.extend_progress_total(1)
+            image_path = self.__file_path(allocator, index, image, info)
+            if image_path is not None:
+                yield image, image_path
+
+    def _pending_downloads(self, urls: Iterable[str], info: ScrappingInfo) -> Iterator[Tuple[str, str]]:
+        """
+        (url, path) of the files not downloaded yet. urls is read once here to
+        size the progress bar, and once more as the result is consumed.
+        """
+        urls = rereadable(urls)
+        total = 0
+        downloaded = 0
+        for image in urls:
+            total += 1
+            downloaded += self.is_processed(image)
+        if downloaded > 0:
+            self.print_statement(
+                f"{downloaded} files already downloaded, skipping them",
+                LogLevel.INFO,
+                info.log_file,
+            )
+        self.print_statement(
+            f"Fetching {total - downloaded} files", LogLevel.INFO, info.log_file
+        )
+        self.init_progress_bar(total - downloaded, self.base_description)
+        allocator = FileNameAllocator(self.directory, self.base_name, self.append_files)
 
+        def downloads() -> Iterator[Tuple[str, str]]:
             for index, image in enumerate(urls):
-                file_extension: str = image.split(".")[-1]
-                if file_extension is None or file_extension == image or file_extension == '' or len(file_extension) > 4:
-                    super().print_statement(f"Unknown file type for {image}", LogLevel.WARNING, info.log_file)
-                    file_extension = "jpg"
-                if file_extension in self.excluded_file_extensions:
-                    super().print_statement(f"{file_extension} file extension found. Skipping.", LogLevel.DEBUG, info.log_file)
+                if self.is_processed(image):
                     continue
-                image_name = f"{self.base_name}-{index+index_offset:04d}.{file_extension.lower()}"
-                image_path = self.directory + image_name
-                while self.append_files and Path(image_path).exists():
-                    index_offset += 1
-                    image_name = f"{self.base_name}-{index+index_offset:04d}.{file_extension.lower()}"
-                    image_path = self.directory + image_name
-
-                future_to_url.update(
-                    {
-                        executor.submit(
-                            self.__download_image, image, image_path, info
-                        ): image
-                    }
-                )
+                image_path = self.__file_path(allocator, index, image, info)
+                if image_path is not None:
+                    yield image, image_path
 
-        failed_urls = []
-        for future in concurrent.futures.as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                res: bool = future.result()
-                self.add_stat(url, res)
-            except Exception as ex:
-                super().log_statement(
-                    f"Could not download image for {url}: {ex}",
-                    LogLevel.ERROR,
-                    info.log_file,
-                )
-                failed_urls.append(url)
-                self.add_stat(url, False)
+        return downloads()
+
+    def stream(
+        self, urls: Iterable[str], emit: Callable[[str], None], info: ScrappingInfo
+    ) -> None:
+        super().init_progress_bar(0, self.base_description)
+        with self.worker_pool(
+            info, self.concurrency.max_limit if self.concurrency is not None else info.max_workers
+        ) as executor, concurrent.futures.ThreadPoolExecutor(max_workers=info.max_workers) as prober:
+            for (url, path), future in iter_completed(
+                executor,
+                lambda d: self.__download_image(d[0], d[1], info),
+                self.__by_size(self._stream_downloads(urls, info), prober, info),
+                info.max_workers * 2,
+                self.retry_policy,
+                self.concurrency,
+            ):
+                if not self._handle_result(url, path, future, info):
+                    emit(url)
+        super().clear_progress_bar()
+
+    def execute(self, urls: Iterable[str], info: ScrappingInfo):
+        """
+        urls is read twice like in URLScrapper.execute.
+        Only a window of files is in flight at any time.
+        """
+        with self.worker_pool(
+            info, self.concurrency.max_limit if self.concurrency is not None else info.max_workers
+        ) as executor, concurrent.futures.ThreadPoolExecutor(max_workers=info.max_workers) as prober:
+            downloads = self._pending_downloads(urls, info)
+            failed_urls = []
+            for (url, path), future in iter_completed(
+                executor,
+                lambda d: self.__download_image(d[0], d[1], info),
+                self.__by_size(downloads, prober, info),
+                info.max_workers * 2,
+                self.retry_policy,
+                self.concurrency,
+            ):
+                if not self._handle_result(url, path, future, info):
+                    failed_urls.append(url)
         super().clear_progress_bar()
         return failed_urls
     
-    def on_exit(self, log_file: Optional[TextIOWrapper]) -> None:
+    def on_exit(self, log_file: Optional[LogSink]) -> None:
+        if self.__segment_executor is not None:
+            self.__segment_executor.shutdown()
+            self.__segment_executor = None
         super().clear_progress_bar()
         super().print_statement(
             f"Tried to download {super().get_tries()} images, failed to download {super().get_fails()}",
@@ -321,21 +950,96 @@ class Scrapper:
         self.job_sequence = job_sequence
         self.name = kwargs.get('name', 'scrapper')
         self.__check_jobs()
-        log_file = None
-
+        # When pipelined, every job runs in its own thread connected by bounded queues
+        self.pipelined: bool = kwargs.get("pipelined", False)
         log_path = Path(kwargs.get("log_path", "./"))
         log_filepaht = Path.joinpath(log_path, kwargs.get("log_file", f"{self.name}.log"))
         log_filepaht.touch(exist_ok=True)
-        log_file = open(log_filepaht, "w+")
+        # Workers only queue their records, a single thread writes them in batches
+        log_file = LogSink(
+            log_filepaht,
+            level=kwargs.get("log_level", LogLevel.DEBUG),
+            max_buffer=kwargs.get("log_buffer", 10000),
+        )
+        max_workers = kwargs.get("max_workers", 1)
+        request_headers = kwargs.get("request_headers", {})
+        # A registry passed in by the caller can aggregate the metrics of several runs
+        metrics = kwargs.get("metrics")
+        if metrics is None:
+            metrics = MetricsRegistry()
+        self.__metrics_exporter: Optional[MetricsExporter] = None
+        # Writes {name}-metrics.json and .prom next to the log, only when asked
+        if kwargs.get("export_metrics", False):
+            self.__metrics_exporter = MetricsExporter(
+                metrics,
+                log_path.joinpath(f"{self.name}-metrics.json"),
+                log_path.joinpath(f"{self.name}-metrics.prom"),
+                kwargs.get("metrics_interval", 10),
+            )
+        # A session passed in by the caller is shared with other runs, so it is not closed here
+        session = kwargs.get("session")
+        self.__owns_session = session is None
+        # Pipelined jobs run at the same time, each one with its own workers
+        concurrent_jobs = len(job_sequence) if self.pipelined else 1
+        if session is None:
+            session = PooledSession(
+                pool_maxsize=kwargs.get("pool_maxsize", max_workers * concurrent_jobs),
+                pool_connections=kwargs.get("pool_connections", 10),
+                headers=request_headers,
+                on_connect=lambda host, seconds: metrics.observe("connect_seconds", seconds, host=host),
+            )
+        # With http2, pages are fetched over a few multiplexed HTTP/2 connections.
+        # Files stay on HTTP/1.1, where every transfer gets its own connection
+        page_session = kwargs.get("page_session")
+        self.__owns_page_session = page_session is None and kwargs.get("http2", False)
+        if self.__owns_page_session:
+            page_session = PooledSession(
+                pool_maxsize=kwargs.get("pool_maxsize", max_workers * concurrent_jobs),
+                headers=request_headers,
+                http2=True,
+            )
+        # A pool passed in by the caller is started and stopped by the caller
+        mirror_pool = kwargs.get("mirror_pool")
+        mirrors = kwargs.get("mirrors")
+        self.__owns_mirror_pool = mirror_pool is None and bool(mirrors)
+        if self.__owns_mirror_pool:
+            mirror_pool = MirrorPool(
+                mirrors,
+                headers=request_headers,
+                probe_path=kwargs.get("probe_path", "/"),
+                probe_interval=kwargs.get("probe_interval", 30),
+            )
+        rate_limiter = kwargs.get("rate_limiter")
+        if rate_limiter is None:
+            rate = kwargs.get("requests_per_second")
+            sparse_requests = kwargs.get("sparse_requests", False)
+            request_cooldown = kwargs.get("request_cooldown", 0)
+            if rate is None and sparse_requests and request_cooldown > 0:
+                # Same ceiling as every worker sleeping `request_cooldown` between requests
+                rate = max_workers / request_cooldown
+            rate_limiter = RateLimiter(
+                rate,
+                kwargs.get("request_burst", max_workers),
+                kwargs.get("host_limits"),
+            )
+        self.queue_size: int = kwargs.get("queue_size", max_workers * 4)
+        # Parsing is CPU bound, with parse_processes it runs outside of the request threads.
+        # The processes only live during run
+        self.parse_processes: Optional[int] = kwargs.get("parse_processes")
         self.scrapping_info = ScrappingInfo(
-            html_parser="html.parser",
-            base_url=kwargs.get("base_url", ""),
-            sparse_requests=kwargs.get("sparse_requests", False),
-            request_cooldown=kwargs.get("request_cooldown", 0),
+            html_parser=resolve_html_parser(kwargs.get("html_parser", "html.parser")),
+            base_url=kwargs.get("base_url", mirror_pool.mirrors[0] if mirror_pool is not None else ""),
             request_timeout=kwargs.get("request_timeout", 10),
-            max_workers=kwargs.get("max_workers", 1),
+            max_workers=max_workers,
             log_file=log_file,
-            request_headers=kwargs.get("request_headers", {}),
+            request_headers=request_headers,
+            session=session,
+            rate_limiter=rate_limiter,
+            metrics=metrics,
+            # Bounds the workers of every Scrapper sharing it, it is not shut down here
+            executor=kwargs.get("executor"),
+            page_session=page_session,
+            mirrors=mirror_pool,
         )
 
     def __check_jobs(self):
@@ -343,14 +1047,119 @@ class Scrapper:
             if job.has_default_name():
                 job.set_name(f"Job {index} - {job.__class__.__name__}")
 
-    def run(self, urls: List[str]):
-        to_process = urls
+    def __run_stage(
+        self,
+        job: ScrappingJob,
+        urls: Iterable[str],
+        emit: Callable[[str], None],
+        source: Optional[ClosableQueue],
+        output: Optional[ClosableQueue],
+    ) -> None:
+        try:
+            job.stream(urls, emit, self.scrapping_info)
+        except Exception as e:
+            job.print_statement(
+                f"Job failed: {e}", LogLevel.ERROR, self.scrapping_info.log_file
+            )
+        finally:
+            try:
+                # The previous job must never block on a full queue. `urls` can't be
+                # drained here, a thread of the job may still be reading it
+                if source is not None:
+                    source.close()
+            finally:
+                if output is not None:
+                    output.put(END_OF_STREAM)
 
-        for job in self.job_sequence:
+    def __timed_input(self, job: ScrappingJob, source: queue.Queue) -> Iterator[str]:
+        """
+        iter_queue recording how long the job waited for the previous one.
+        """
+        items = iter_queue(source)
+        while True:
+            started_at = time.perf_counter()
+            item = next(items, END_OF_STREAM)
+            self.scrapping_info.metrics.increment(
+                "queue_wait_seconds_total", time.perf_counter() - started_at, job=job.get_name(), side="input"
+            )
+            if item is END_OF_STREAM:
+                return
+            yield item
+
+    def __timed_output(self, job: ScrappingJob, output: queue.Queue) -> Callable[[str], None]:
+        """
+        output.put recording how long the job was blocked by the next one.
+        """
+        def put(item: str) -> None:
+            started_at = time.perf_counter()
+            output.put(item)
+            self.scrapping_info.metrics.increment(
+                "queue_wait_seconds_total", time.perf_counter() - started_at, job=job.get_name(), side="output"
+            )
+        return put
+
+    def __run_pipelined(self, urls: List[str]) -> List[str]:
+        results = []
+        stages = []
+        inputs: Iterable[str] = iter(urls)
+        source: Optional[ClosableQueue] = None
+        for index, job in enumerate(self.job_sequence):
             print("Starting job", job.name)
-            to_process = job.execute(to_process, self.scrapping_info)
+            is_last = index == len(self.job_sequence) - 1
+            output = None if is_last else ClosableQueue(maxsize=self.queue_size)
+            emit = results.append if is_last else self.__timed_output(job, output)
+            stage = threading.Thread(
+                target=self.__run_stage,
+                args=(job, inputs, emit, source, output),
+                name=job.name,
+                daemon=True,
+            )
+            stage.start()
+            stages.append(stage)
+            if output is not None:
+                inputs = self.__timed_input(self.job_sequence[index + 1], output)
+                source = output
+
+        for stage in stages:
+            stage.join()
+        for job in self.job_sequence:
             job.on_exit(self.scrapping_info.log_file)
+        return results
 
-        if self.scrapping_info.log_file is not None:
-            self.scrapping_info.log_file.close()
+    def run(self, urls: List[str]):
+        to_process = urls
+
+        if self.__metrics_exporter is not None:
+            self.__metrics_exporter.start()
+        if self.__owns_mirror_pool:
+            self.scrapping_info.mirrors.start()
+        try:
+            if self.parse_processes:
+                self.scrapping_info.parse_executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.parse_processes,
+                    # Forking a process that runs threads can copy held locks
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            if self.pipelined:
+                to_process = self.__run_pipelined(urls)
+            else:
+                for job in self.job_sequence:
+                    print("Starting job", job.name)
+                    to_process = job.execute(to_process, self.scrapping_info)
+                    job.on_exit(self.scrapping_info.log_file)
+        finally:
+            if self.__metrics_exporter is not None:
+                self.__metrics_exporter.stop()
+            if self.scrapping_info.parse_executor is not None:
+                self.scrapping_info.parse_executor.shutdown()
+                self.scrapping_info.parse_executor = None
+            if self.__owns_mirror_pool:
+                self.scrapping_info.mirrors.stop()
+            if self.__owns_session:
+                self.scrapping_info.session.close()
+            if self.__owns_page_session:
+                self.scrapping_info.page_session.close()
+            # Last, so the records of a failed run are written too
+            if self.scrapping_info.log_file is not None:
+                self.scrapping_info.log_file.close()
         return to_process
@@ -0,0 +1,461 @@
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlsplit
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import os
+import time
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from scrapper import ScrappingInfo, URLScrapper, FileDownloader, extract_urls
+from scrapper.logs import LogLevel
+from scrapper.limits import ByteBudgetExceeded, ConcurrencyController
+from scrapper.scheduling import END_OF_STREAM, RetryPolicy
+from scrapper.storage import PartialDownload
+from scrapper.utils import check_response, content_range_start, content_range_total, hash_file, rereadable
+
+T = TypeVar("T")
+
+
+async def iter_input(items: Iterable[T], blocking: bool = False) -> AsyncIterator[T]:
+    """
+    Async iterator over items. Blocking iterables, like a queue fed by another
+    job, are read from a thread so the event loop keeps running meanwhile.
+    """
+    if not blocking:
+        for item in items:
+            yield item
+        return
+    loop = asyncio.get_running_loop()
+    iterator = iter(items)
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, END_OF_STREAM)
+        if item is END_OF_STREAM:
+            return
+        yield item
+
+
+async def iter_completed_async(
+    fn: Callable[[T], Awaitable],
+    items: AsyncIterator[T],
+    window: int,
+    retry_policy: Optional[RetryPolicy] = None,
+    concurrency: Optional[ConcurrencyController] = None,
+) -> AsyncIterator[Tuple[T, asyncio.Task]]:
+    """
+    iter_completed for coroutines: runs fn(item) as a task for every item,
+    keeping at most `window` of them in flight, and yields (item, task) pairs
+    as soon as each one finishes. Retries and the concurrency controller work
+    as in iter_completed, a retry keeps its slot while it waits.
+    """
+    loop = asyncio.get_running_loop()
+    # task -> (item, attempt, start time)
+    tasks: Dict[asyncio.Task, Tuple[T, int, float]] = {}
+    # (due time, tie breaker, item, attempt)
+    retries: List[Tuple[float, int, T, int]] = []
+    sequence = itertools.count()
+    reader: Optional[asyncio.Task] = None
+    exhausted = False
+    feed_error: Optional[Exception] = None
+
+    def current_window() -> int:
+        return max(1, concurrency.limit if concurrency is not None else window)
+
+    def start(item: T, attempt: int) -> None:
+        tasks[asyncio.ensure_future(fn(item))] = (item, attempt, loop.time())
+
+    try:
+        while True:
+            while retries and retries[0][0] <= loop.time():
+                _, _, item, attempt = heapq.heappop(retries)
+                start(item, attempt)
+            if not exhausted and reader is None and len(tasks) + len(retries) < current_window():
+                reader = asyncio.ensure_future(items.__anext__())
+            waiting = set(tasks)
+            if reader is not None:
+                waiting.add(reader)
+            if not waiting and not retries:
+                break
+            timeout = max(0.0, retries[0][0] - loop.time()) if retries else None
+            if not waiting:
+                await asyncio.sleep(timeout)
+                continue
+            finished, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if reader is not None and reader in finished:
+                finished.discard(reader)
+                try:
+                    start(reader.result(), 1)
+                except StopAsyncIteration:
+                    exhausted = True
+                except Exception as e:
+                    exhausted = True
+                    feed_error = e
+                reader = None
+            for task in finished:
+                item, attempt, started_at = tasks.pop(task)
+                error = task.exception() if not task.cancelled() else None
+                if concurrency is not None:
+                    concurrency.record(loop.time() - started_at, error)
+                delay = retry_policy.next_delay(attempt, error) if retry_policy is not None and error is not None else None
+                if delay is not None:
+                    heapq.heappush(retries, (loop.time() + delay, next(sequence), item, attempt + 1))
+                    continue
+                yield item, task
+    finally:
+        # Only reached with work left if the consumer stops early or fails
+        for task in tasks:
+            task.cancel()
+        if reader is not None:
+            reader.cancel()
+    if feed_error is not None:
+        raise feed_error
+
+
+@contextmanager
+def translate_errors() -> Iterator[None]:
+    """
+    Raises aiohttp errors as their requests equivalents, so retry policies,
+    logs and metrics treat both engines alike.
+    """
+    try:
+        yield
+    except aiohttp.ClientPayloadError as e:
+        raise requests.exceptions.ChunkedEncodingError(str(e)) from e
+    except (aiohttp.ServerTimeoutError, asyncio.TimeoutError) as e:
+        raise requests.Timeout(str(e)) from e
+    except aiohttp.ClientConnectionError as e:
+        raise requests.ConnectionError(str(e)) from e
+    except aiohttp.ClientError as e:
+        raise requests.RequestException(str(e)) from e
+
+
+def write_chunk(file, hasher, chunk: bytes) -> None:
+    file.write(chunk)
+    if hasher is not None:
+        hasher.update(chunk)
+
+
+class AsyncJob:
+    """
+    Requests made as tasks of an event loop instead of on worker threads, so
+    every request in flight costs a coroutine and a socket, not a thread.
+    Requires aiohttp.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        try:
+            super(AsyncJob, self).__init__(**kwargs)
+        except TypeError:
+            super(AsyncJob, self).__init__()
+        if aiohttp is None:
+            raise ImportError("The asyncio jobs need aiohttp, install it with 'pip install aiohttp'")
+        # Requests in flight, and connections open at the same time
+        self.connections: int = kwargs.get("connections", 1000)
+        # 0 doesn't limit the connections to a single host
+        self.connections_per_host: int = kwargs.get("connections_per_host", 0)
+
+    def open_session(self, info: ScrappingInfo) -> "aiohttp.ClientSession":
+        """
+        Must be called from the event loop that will use the session.
+        """
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections, limit_per_host=self.connections_per_host),
+            headers=info.request_headers,
+        )
+
+    @asynccontextmanager
+    async def request_async(
+        self,
+        session: "aiohttp.ClientSession",
+        url: str,
+        info: ScrappingInfo,
+        method: str = "GET",
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> AsyncIterator["aiohttp.ClientResponse"]:
+        """
+        Counterpart of ScrappingJob.request. `timeout` bounds the connection and
+        every read like in requests, the transfer has to be recorded by the caller.
+        """
+        mirror = None
+        if info.mirrors is not None:
+            url, mirror = info.mirrors.resolve(url)
+        labels = dict(job=self.get_name(), host=urlsplit(url).netloc)
+        with info.metrics.timer("rate_limit_wait_seconds", **labels):
+            wait = info.rate_limiter.reserve(url)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        started_at = time.perf_counter()
+        try:
+            with translate_errors():
+                response = await session.request(
+                    method,
+                    url,
+                    timeout=aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout),
+                    **kwargs,
+                )
+        except requests.RequestException as e:
+            info.metrics.increment("requests_total", method=method, status=e.__class__.__name__, **labels)
+            if mirror is not None:
+                info.mirrors.record(mirror, None, None, url)
+            raise
+        ttfb = time.perf_counter() - started_at
+        info.metrics.increment("requests_total", method=method, status=response.status, **labels)
+        info.metrics.observe("request_seconds", ttfb, phase="ttfb", **labels)
+        if mirror is not None:
+            info.mirrors.record(mirror, ttfb, response.status, url)
+        try:
+            with translate_errors():
+                yield response
+        finally:
+            response.release()
+
+
+class AsyncURLScrapper(URLScrapper, AsyncJob):
+    """
+    URLScrapper whose pages are requested from an event loop, `connections` at
+    a time. Pages are parsed on the loop, or in the Scrapper parse_processes.
+    """
+
+    async def fetch_urls(self, session: "aiohttp.ClientSession", url: str, info: ScrappingInfo) -> Optional[List[str]]:
+        """
+        Same as get_urls: None if the page failed, retryable errors are raised.
+        """
+        try:
+            async with self.request_async(session, url, info, timeout=info.request_timeout) as response:
+                check_response(response)
+                started_at = time.perf_counter()
+                content = await response.read()
+                self.record_transfer(url, info, time.perf_counter() - started_at, len(content))
+            with info.metrics.timer("parse_seconds", job=self.get_name()):
+                urls = await self.__extract(content, info)
+            return self.complete_urls(urls, info)
+        except Exception as e:
+            if self.retry_policy.is_retryable(e):
+                raise
+            self.add_fail()
+            self.log_statement(f"Failed job for {url}: {e}", LogLevel.ERROR, info.log_file)
+            return None
+
+    async def __extract(self, content: bytes, info: ScrappingInfo) -> List[str]:
+        if info.parse_executor is None:
+            return extract_urls(self.job, self.parse_only, content, info.html_parser)
+        return await asyncio.wrap_future(
+            info.parse_executor.submit(extract_urls, self.job, self.parse_only, content, info.html_parser)
+        )
+
+    async def __scan(self, urls: AsyncIterator[str], info: ScrappingInfo) -> AsyncIterator[List[str]]:
+        async with self.open_session(info) as session:
+            async for url, task in iter_completed_async(
+                lambda u: self.fetch_urls(session, u, info),
+                urls,
+                self.connections,
+                self.retry_policy,
+                self.concurrency,
+            ):
+                yield self._handle_result(url, task, info)
+
+    def stream(self, urls: Iterable[str], emit: Callable[[str], None], info: ScrappingInfo) -> None:
+        self.init_progress_bar(0, self.base_description)
+        self.found_len = 0
+
+        def emit_all(links: List[str]) -> None:
+            for link in links:
+                emit(link)
+
+        async def scan() -> None:
+            loop = asyncio.get_running_loop()
+            pending = self.count_progress_total(self._pending_pages(urls, emit))
+            async for links in self.__scan(iter_input(pending, blocking=True), info):
+                self._count_found(len(links))
+                # emit blocks while the queue of the next job is full
+                await loop.run_in_executor(None, emit_all, links)
+
+        asyncio.run(scan())
+        self.clear_progress_bar()
+
+    def execute(self, urls: Iterable[str], info: ScrappingInfo):
+        urls = rereadable(urls)
+        output_links, pending_count = self._scan_previous(urls, info)
+        self.init_progress_bar(pending_count, self.base_description)
+
+        async def scan() -> None:
+            pending = (url for url in urls if not self.is_processed(url))
+            async for links in self.__scan(iter_input(pending), info):
+                output_links.extend(links)
+
+        asyncio.run(scan())
+        self.clear_progress_bar()
+        self.found_len = len(output_links)
+        return output_links
+
+
+class AsyncFileDownloader(FileDownloader, AsyncJob):
+    """
+    FileDownloader whose files are requested from an event loop, `connections`
+    at a time. Files are always streamed, and the chunks are written to disk by
+    a pool of `writer_threads` threads so the loop never waits on the disk.
+    Segmented downloads, size policies and mmap writes are not supported.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncFileDownloader, self).__init__(*args, **kwargs)
+        if self.segments > 1 or self.size_policy is not None or self.use_mmap:
+            raise ValueError("AsyncFileDownloader doesn't support segments, size_policy or use_mmap")
+        self.writer_threads: int = kwargs.get("writer_threads", 4)
+        self.__writer: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    async def __disk(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__writer, fn, *args)
+
+    async def __throttle(self, amount: int, reserved: bool) -> None:
+        if self.bandwidth_limiter is not None:
+            wait = self.bandwidth_limiter.reserve(amount)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        if self.byte_budget is not None and not reserved:
+            self.byte_budget.consume(amount)
+
+    async def __stream_to_file(
+        self, session: "aiohttp.ClientSession", url: str, path: str, info: ScrappingInfo
+    ) -> None:
+        """
+        Same steps as the threaded version: resumes a partial file with a Range
+        request and moves it into place once the whole body has been received.
+        """
+        partial = PartialDownload(path, url, self.partial_suffix)
+        offset = await self.__disk(partial.load) if self.resume_downloads else 0
+        # Left by a segmented download, the preallocated file is downloaded again
+        partial.completed_segments = None
+        hasher = self.content_store.new_hash() if self.content_store is not None else None
+        received = offset
+        reserved = 0
+        try:
+            async with self.request_async(
+                session,
+                url,
+                info,
+                timeout=self.file_download_timeout,
+                headers=partial.range_headers(offset) if offset > 0 else None,
+            ) as response:
+                if response.status == 416 and offset > 0 and content_range_total(response) == offset:
+                    # The previous attempt already received the whole file
+                    received = offset
+                    if hasher is not None:
+                        await self.__disk(hash_file, hasher, partial.tmp_path, self.buffer_size)
+                else:
+                    check_response(response)
+                    if offset > 0 and (response.status != 206 or content_range_start(response) != offset):
+                        offset = 0
+                    partial.etag = response.headers.get("ETag")
+                    partial.last_modified = response.headers.get("Last-Modified")
+                    total_size = content_range_total(response) if offset > 0 else None
+                    if total_size is None and response.headers.get("Content-Length") is not None:
+                        total_size = int(response.headers["Content-Length"])
+                    if await self.__disk(self._reuse_stored, url, total_size, path):
+                        await self.__disk(partial.discard)
+                        return
+                    reserved = self._reserve(total_size - offset if total_size is not None else None)
+                    if self.resume_downloads:
+                        await self.__disk(partial.save, offset)
+                    received = offset
+                    if hasher is not None and offset > 0:
+                        await self.__disk(hash_file, hasher, partial.tmp_path, self.buffer_size)
+                    transfer_started_at = time.perf_counter()
+                    disk_seconds = 0.0
+                    file = await self.__disk(open, partial.tmp_path, "ab" if offset > 0 else "wb")
+                    try:
+                        async for chunk in response.content.iter_chunked(self.buffer_size):
+                            await self.__throttle(len(chunk), reserved > 0)
+                            write_started_at = time.perf_counter()
+                            await self.__disk(write_chunk, file, hasher, chunk)
+                            disk_seconds += time.perf_counter() - write_started_at
+                            received += len(chunk)
+                    finally:
+                        await self.__disk(file.close)
+                    self.record_transfer(
+                        url, info, time.perf_counter() - transfer_started_at - disk_seconds, received - offset
+                    )
+                    info.metrics.observe("disk_write_seconds", disk_seconds, job=self.get_name())
+            digest = hasher.hexdigest() if hasher is not None else None
+            await self.__disk(self._commit_file, url, digest, received, partial.tmp_path, path)
+            await self.__disk(partial.finish)
+        except BaseException:
+            if reserved > 0:
+                self.byte_budget.release(max(0, reserved - (received - offset)))
+            if not self.resume_downloads:
+                partial.discard()
+            elif os.path.exists(partial.tmp_path):
+                partial.save(received)
+            raise
+
+    async def download_file(self, session: "aiohttp.ClientSession", url: str, path: str, info: ScrappingInfo) -> bool:
+        try:
+            if await self.__disk(self._reuse_stored, url, None, path):
+                return True
+            if self.byte_budget is not None and self.byte_budget.closed:
+                raise ByteBudgetExceeded(f"Byte budget reached, skipping {url}")
+            await self.__stream_to_file(session, url, path, info)
+        except ByteBudgetExceeded as ex:
+            # Not a failure of the file, it stays pending for a later run
+            self.log_statement(ex, LogLevel.WARNING, info.log_file)
+            return False
+        except Exception as ex:
+            if self.retry_policy.is_retryable(ex):
+                raise
+            self.log_statement(ex, LogLevel.ERROR, info.log_file)
+            self.add_fail()
+            return False
+        else:
+            return True
+
+    async def __download_all(
+        self, downloads: AsyncIterator[Tuple[str, str]], info: ScrappingInfo
+    ) -> AsyncIterator[Tuple[Tuple[str, str], asyncio.Task]]:
+        self.__writer = concurrent.futures.ThreadPoolExecutor(max_workers=self.writer_threads)
+        try:
+            async with self.open_session(info) as session:
+                async for download, task in iter_completed_async(
+                    lambda d: self.download_file(session, d[0], d[1], info),
+                    downloads,
+                    self.connections,
+                    self.retry_policy,
+                    self.concurrency,
+                ):
+                    yield download, task
+        finally:
+            self.__writer.shutdown()
+            self.__writer = None
+
+    def stream(self, urls: Iterable[str], emit: Callable[[str], None], info: ScrappingInfo) -> None:
+        self.init_progress_bar(0, self.base_description)
+
+        async def download() -> None:
+            loop = asyncio.get_running_loop()
+            downloads = iter_input(self._stream_downloads(urls, info), blocking=True)
+            async for (url, path), task in self.__download_all(downloads, info):
+                if not self._handle_result(url, path, task, info):
+                    await loop.run_in_executor(None, emit, url)
+
+        asyncio.run(download())
+        self.clear_progress_bar()
+
+    def execute(self, urls: Iterable[str], info: ScrappingInfo):
+        downloads = self._pending_downloads(urls, info)
+        failed_urls = []
+
+        async def download() -> None:
+            async for (url, path), task in self.__download_all(iter_input(downloads), info):
+                if not self._handle_result(url, path, task, info):
+                    failed_urls.append(url)
+
+        asyncio.run(download())
+        self.clear_progress_bar()
+        return failed_urls
@@ -0,0 +1,237 @@
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import threading
+import time
+
+from scrapper.utils import ResponseError
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float = 1) -> None:
+        """
+        rate: tokens added per second
+        burst: max amount of tokens that can be accumulated while idle
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, is {rate}")
+        self.rate = rate
+        self.capacity = max(1.0, float(burst))
+        self.__tokens = self.capacity
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Takes `amount` tokens from the bucket and returns how many seconds the caller
+        has to wait before using them. The bucket may go into debt, so concurrent
+        callers are queued one after another instead of all waking up at once.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(
+                self.capacity, self.__tokens + (now - self.__updated_at) * self.rate
+            )
+            self.__updated_at = now
+            self.__tokens -= amount
+            if self.__tokens >= 0:
+                return 0
+            return -self.__tokens / self.rate
+
+    def acquire(self, amount: float = 1) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Keeps one token bucket per host, shared by every worker that uses the limiter.
+    Hosts without an entry in `host_limits` use the default `rate` and `burst`.
+    A limiter without a rate lets every request through.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: float = 1,
+        host_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.host_limits = host_limits if host_limits is not None else {}
+        self.__buckets: Dict[str, Optional[TokenBucket]] = {}
+        self.__lock = threading.Lock()
+
+    def __get_bucket(self, host: str) -> Optional[TokenBucket]:
+        with self.__lock:
+            if host not in self.__buckets:
+                rate, burst = self.host_limits.get(host, (self.rate, self.burst))
+                self.__buckets[host] = (
+                    TokenBucket(rate, burst) if rate is not None else None
+                )
+            return self.__buckets[host]
+
+    def reserve(self, url: str) -> float:
+        bucket = self.__get_bucket(urlsplit(url).netloc)
+        return bucket.reserve() if bucket is not None else 0
+
+    def acquire(self, url: str) -> None:
+        wait = self.reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ConcurrencyController:
+    """
+    AIMD limit on the number of requests a job keeps in flight.
+    Outcomes are evaluated in rounds of about `limit` requests: a round with
+    throttling responses or too many errors divides the limit by
+    `decrease_factor`, a round with latencies well above the best seen so far or
+    with a throughput lower than the previous round takes one step back, and
+    any other round adds one to the limit.
+    """
+
+    def __init__(
+        self,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        initial: Optional[int] = None,
+        max_error_rate: float = 0.1,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 2.0,
+        throttle_statuses: Tuple[int, ...] = (429, 503),
+    ) -> None:
+        """
+        initial: starting limit, half of max_limit by default
+        latency_tolerance: how many times the baseline latency a round may take before backing off
+        """
+        if min_limit < 1 or max_limit < min_limit:
+            raise ValueError(f"Invalid concurrency bounds [{min_limit}, {max_limit}]")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_error_rate = max_error_rate
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.throttle_statuses = set(throttle_statuses)
+        self.__limit = float(
+            self.__clamp(initial if initial is not None else max_limit // 2)
+        )
+        self.__baseline_latency: Optional[float] = None
+        self.__last_throughput: Optional[float] = None
+        self.__increased = False
+        self.__lock = threading.Lock()
+        self.__start_round()
+
+    @property
+    def limit(self) -> int:
+        return int(self.__limit)
+
+    def __clamp(self, limit: float) -> float:
+        return min(float(self.max_limit), max(float(self.min_limit), limit))
+
+    def __start_round(self) -> None:
+        self.__round_started_at = time.monotonic()
+        self.__samples = 0
+        self.__errors = 0
+        self.__throttled = False
+        self.__latency_sum = 0.0
+
+    def record(self, latency: float, error: Optional[BaseException] = None) -> None:
+        """
+        Reports the outcome of one request, `latency` being its duration in seconds.
+        """
+        with self.__lock:
+            self.__samples += 1
+            if error is None:
+                self.__latency_sum += latency
+            else:
+                self.__errors += 1
+                if isinstance(error, ResponseError) and error.status_code in self.throttle_statuses:
+                    self.__throttled = True
+            if self.__throttled or self.__samples >= max(self.limit, 4):
+                self.__end_round()
+
+    def __end_round(self) -> None:
+        elapsed = max(time.monotonic() - self.__round_started_at, 1e-6)
+        throughput = self.__samples / elapsed
+        successes = self.__samples - self.__errors
+        latency = self.__latency_sum / successes if successes > 0 else None
+        increased = False
+        if self.__throttled or self.__errors / self.__samples > self.max_error_rate:
+            self.__limit = self.__clamp(self.__limit / self.decrease_factor)
+        elif (
+            latency is not None
+            and self.__baseline_latency is not None
+            and latency > self.__baseline_latency * self.latency_tolerance
+        ):
+            self.__limit = self.__clamp(self.__limit - 1)
+        elif (
+            self.__increased
+            and self.__last_throughput is not None
+            and throughput < self.__last_throughput * 0.9
+        ):
+            # The last increase did not pay off
+            self.__limit = self.__clamp(self.__limit - 1)
+        else:
+            self.__limit = self.__clamp(self.__limit + 1)
+            increased = True
+        if latency is not None:
+            # The baseline slowly follows latencies that stay high, e.g. bigger files
+            self.__baseline_latency = (
+                latency
+                if self.__baseline_latency is None
+                else min(latency, self.__baseline_latency * 1.05)
+            )
+        self.__last_throughput = throughput
+        self.__increased = increased
+        self.__start_round()
+
+
+class ByteBudgetExceeded(Exception):
+    pass
+
+
+class ByteBudget:
+    """
+    Hard limit on the bytes downloaded by every job that shares it. Files of
+    known size reserve it before starting, the others are charged as they are
+    received. Once a file doesn't fit the budget is closed and every later
+    reservation fails, so no new file is started.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.__committed = 0
+        self.__closed = False
+        self.__lock = threading.Lock()
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    @property
+    def used(self) -> int:
+        return self.__committed
+
+    def reserve(self, size: int) -> None:
+        with self.__lock:
+            if self.__closed or self.__committed + size > self.limit:
+                self.__closed = True
+                raise ByteBudgetExceeded(
+                    f"Downloading {size} more bytes would exceed the budget of {self.limit} bytes"
+                )
+            self.__committed += size
+
+    def release(self, size: int) -> None:
+        """
+        Returns reserved bytes that were not received.
+        """
+        with self.__lock:
+            self.__committed -= size
+
+    def consume(self, amount: int) -> None:
+        with self.__lock:
+            self.__committed += amount
+            if self.__committed > self.limit:
+                self.__closed = True
+                raise ByteBudgetExceeded(f"The budget of {self.limit} bytes was exceeded")
@@ -0,0 +1,144 @@
+from typing import Dict, List, Optional, TextIO, Tuple
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+import queue
+import sys
+import threading
+
+
+class LogLevel(Enum):
+    ERROR = "ERROR"
+    WARNING = "WARNING"
+    INFO = "INFO"
+    DEBUG = "DEBUG"
+
+
+# Lower is more severe
+LEVEL_RANKS = {LogLevel.ERROR: 0, LogLevel.WARNING: 1, LogLevel.INFO: 2, LogLevel.DEBUG: 3}
+
+# level, job name, creation time, message, also shown on stdout
+LogRecord = Tuple[LogLevel, str, datetime, object, bool]
+
+# Put by close after the last record
+END_OF_LOG = object()
+
+
+def format_record(lvl: LogLevel, name: str, created: datetime, msg: object) -> str:
+    return f"{lvl.value}: {name} - {created.isoformat()}| {msg}"
+
+
+class LogSink:
+    """
+    Log file written by a single thread. Jobs only put records in a bounded
+    queue, which the writer drains in batches of up to `batch_size` records with
+    one write and one flush each. Records below `level` are discarded before
+    being formatted, and records that don't fit in the queue are dropped and
+    counted instead of blocking the workers.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        level: LogLevel = LogLevel.DEBUG,
+        max_buffer: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        stdout: Optional[TextIO] = None,
+    ) -> None:
+        """
+        max_buffer: records waiting to be written before new ones are dropped
+        stdout: stream for echoed records, sys.stdout at the time of writing by default
+        """
+        self.path = path
+        self.level = level
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stdout = stdout
+        self.dropped: Dict[LogLevel, int] = {lvl: 0 for lvl in LogLevel}
+        self.__records: queue.Queue = queue.Queue(maxsize=max_buffer)
+        self.__file: TextIO = open(path, "w+")
+        self.__writer: Optional[threading.Thread] = None
+        self.__lock = threading.Lock()
+        self.__closed = False
+
+    def accepts(self, lvl: LogLevel) -> bool:
+        return LEVEL_RANKS[lvl] <= LEVEL_RANKS[self.level]
+
+    def submit(self, lvl: LogLevel, name: str, msg: object, echo: bool = False) -> None:
+        """
+        Queues a record for the log file, and for stdout too if `echo` is set.
+        """
+        if not self.accepts(lvl):
+            return
+        if self.__writer is None:
+            self.__start()
+        record = (lvl, name, datetime.now(), msg, echo)
+        with self.__lock:
+            try:
+                if self.__closed:
+                    raise queue.Full
+                self.__records.put_nowait(record)
+            except queue.Full:
+                self.dropped[lvl] += 1
+
+    def get_dropped(self) -> int:
+        with self.__lock:
+            return sum(self.dropped.values())
+
+    def __start(self) -> None:
+        with self.__lock:
+            if self.__writer is None and not self.__closed:
+                self.__writer = threading.Thread(target=self.__write, name="log-writer", daemon=True)
+                self.__writer.start()
+
+    def __next_batch(self) -> Tuple[List[LogRecord], bool]:
+        batch: List[LogRecord] = []
+        try:
+            record = self.__records.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch, False
+        while True:
+            if record is END_OF_LOG:
+                return batch, True
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            try:
+                record = self.__records.get_nowait()
+            except queue.Empty:
+                return batch, False
+
+    def __write(self) -> None:
+        closing = False
+        while not closing:
+            batch, closing = self.__next_batch()
+            if not batch:
+                continue
+            lines = [format_record(lvl, name, created, msg) + "\n" for lvl, name, created, msg, _ in batch]
+            self.__file.write("".join(lines))
+            self.__file.flush()
+            echoed = [line for line, record in zip(lines, batch) if record[4]]
+            if echoed:
+                stdout = self.stdout if self.stdout is not None else sys.stdout
+                stdout.write("".join(echoed))
+                stdout.flush()
+
+    def close(self) -> None:
+        """
+        Writes the queued records and closes the file. Later records are dropped.
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            writer = self.__writer
+        if writer is not None:
+            # Blocks until there is room, the close marker must not be dropped
+            self.__records.put(END_OF_LOG)
+            writer.join()
+        dropped = self.get_dropped()
+        if dropped > 0:
+            counts = ", ".join(f"{lvl.value}: {count}" for lvl, count in self.dropped.items() if count > 0)
+            self.__file.write(f"{dropped} log records dropped because the buffer was full ({counts})\n")
+        self.__file.close()
@@ -0,0 +1,190 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from bisect import bisect_left
+from pathlib import Path
+import json
+import math
+import os
+import threading
+import time
+
+# Upper bounds in seconds, an implicit +Inf bucket follows the last one
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> Iterator[Tuple[float, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+    Thread safe set of counters and latency histograms, identified by a name and
+    a set of labels like the job or the host. Snapshots can be written as JSON
+    or in the Prometheus text format.
+    """
+
+    def __init__(self, prefix: str = "scrapper") -> None:
+        self.prefix = prefix
+        self.started_at = time.monotonic()
+        self.__counters: Dict[Tuple[str, Labels], float] = {}
+        self.__histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __key(name: str, labels: dict) -> Tuple[str, Labels]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        key = self.__key(name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self.__key(name, labels)
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """
+        Observes the time spent in the block, also when it raises.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        with self.__lock:
+            counters = [
+                dict(
+                    name=f"{self.prefix}_{name}",
+                    labels=dict(labels),
+                    value=value,
+                    per_second=value / elapsed if elapsed > 0 else 0,
+                )
+                for (name, labels), value in sorted(self.__counters.items())
+            ]
+            histograms = [
+                dict(
+                    name=f"{self.prefix}_{name}",
+                    labels=dict(labels),
+                    count=histogram.count,
+                    sum=histogram.sum,
+                    mean=histogram.sum / histogram.count if histogram.count else 0,
+                    buckets={
+                        ("+Inf" if math.isinf(bound) else str(bound)): count
+                        for bound, count in histogram.cumulative()
+                    },
+                )
+                for (name, labels), histogram in sorted(self.__histograms.items())
+            ]
+        return dict(elapsed_seconds=elapsed, counters=counters, histograms=histograms)
+
+    def to_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines: List[str] = []
+        declared = set()
+
+        def declare(name: str, kind: str) -> None:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for counter in snapshot["counters"]:
+            declare(counter["name"], "counter")
+            lines.append(f"{counter['name']}{format_labels(counter['labels'])} {counter['value']}")
+        for histogram in snapshot["histograms"]:
+            name = histogram["name"]
+            declare(name, "histogram")
+            for bound, count in histogram["buckets"].items():
+                labels = format_labels(dict(histogram["labels"], le=bound))
+                lines.append(f"{name}_bucket{labels} {count}")
+            labels = format_labels(histogram["labels"])
+            lines.append(f"{name}_sum{labels} {histogram['sum']}")
+            lines.append(f"{name}_count{labels} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, json_path: Optional[Path] = None, prometheus_path: Optional[Path] = None) -> None:
+        """
+        Writes the current snapshot, replacing the previous files atomically.
+        """
+        if json_path is not None:
+            write_atomically(json_path, json.dumps(self.snapshot(), indent=4))
+        if prometheus_path is not None:
+            write_atomically(prometheus_path, self.to_prometheus())
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def write_atomically(path: Path, content: str) -> None:
+    tmp_path = Path(f"{path}.tmp")
+    with tmp_path.open("w") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """
+    Exports the registry every `interval` seconds from a background thread,
+    and one last time when stopped.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        json_path: Optional[Path],
+        prometheus_path: Optional[Path],
+        interval: float = 10,
+    ) -> None:
+        self.registry = registry
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def __run(self) -> None:
+        while not self.__stopped.wait(self.interval):
+            self.registry.export(self.json_path, self.prometheus_path)
+
+    def start(self) -> None:
+        self.__thread = threading.Thread(target=self.__run, name="metrics-exporter", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.registry.export(self.json_path, self.prometheus_path)
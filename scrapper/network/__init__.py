@@ -0,0 +1,390 @@
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional, Tuple, Union
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+import asyncio
+import threading
+import time
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def timed_pool_classes(on_connect: Callable[[str, float], None]) -> dict:
+    """
+    Connection pool classes whose connections call on_connect(host, seconds)
+    with the time taken to open them: name resolution, TCP and TLS handshakes.
+    """
+
+    def timed(connection_cls: type) -> type:
+        class TimedConnection(connection_cls):
+            def connect(self) -> None:
+                started_at = time.perf_counter()
+                super(TimedConnection, self).connect()
+                on_connect(self.host, time.perf_counter() - started_at)
+
+        return TimedConnection
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = timed(HTTPConnection)
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = timed(HTTPSConnection)
+
+    return {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def __init__(self, on_connect: Callable[[str, float], None], **kwargs) -> None:
+        self.on_connect = on_connect
+        super(TimedHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = timed_pool_classes(self.on_connect)
+
+
+@contextmanager
+def translate_httpx_errors(reading: bool = False) -> Iterator[None]:
+    """
+    Raises httpx errors as their requests equivalents, so retry policies,
+    logs and metrics treat both transports alike.
+    """
+    try:
+        yield
+    except httpx.ConnectTimeout as e:
+        raise requests.ConnectTimeout(str(e)) from e
+    except httpx.TimeoutException as e:
+        raise requests.ReadTimeout(str(e)) from e
+    except httpx.TransportError as e:
+        if reading:
+            raise requests.exceptions.ChunkedEncodingError(str(e)) from e
+        raise requests.ConnectionError(str(e)) from e
+    except httpx.HTTPError as e:
+        raise requests.RequestException(str(e)) from e
+
+
+# Connection specific headers, not allowed in HTTP/2
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"}
+
+
+class HttpxBody:
+    """
+    Body of an httpx response seen as the raw body of a requests Response.
+    Chunks are read on the event loop of the adapter that sent the request.
+    """
+
+    def __init__(self, response: "httpx.Response", run: Callable[[Coroutine], Any]) -> None:
+        self.response = response
+        self.reason = response.reason_phrase
+        self.__run = run
+        self.__buffer = bytearray()
+        self.__chunks: Optional[Iterator[bytes]] = None
+
+    def stream(self, chunk_size: Optional[int] = None, decode_content: bool = True) -> Iterator[bytes]:
+        chunks = self.response.aiter_bytes(chunk_size)
+
+        async def next_chunk() -> bytes:
+            return await chunks.__anext__()
+
+        with translate_httpx_errors(reading=True):
+            while True:
+                try:
+                    chunk = self.__run(next_chunk())
+                except StopAsyncIteration:
+                    return
+                yield chunk
+
+    def read(self, amount: Optional[int] = None) -> bytes:
+        if self.__chunks is None:
+            self.__chunks = self.stream()
+        while amount is None or len(self.__buffer) < amount:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                break
+            self.__buffer += chunk
+        size = len(self.__buffer) if amount is None else amount
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+    def close(self) -> None:
+        self.__run(self.response.aclose())
+
+    release_conn = close
+
+
+class Http2Adapter(BaseAdapter):
+    """
+    requests transport on an httpx client, so concurrent requests to a host
+    are multiplexed over a few HTTP/2 connections instead of one connection
+    each. https urls negotiate HTTP/2 and fall back to HTTP/1.1, plain http
+    urls need `prior_knowledge` of a server speaking cleartext HTTP/2.
+    The client runs on an event loop thread of its own, which every worker
+    hands its requests to, since the connection state can't be shared by
+    threads. Requires httpx with its http2 extra.
+    """
+
+    def __init__(self, max_connections: int, prior_knowledge: bool = False) -> None:
+        super(Http2Adapter, self).__init__()
+        if httpx is None:
+            raise ImportError("HTTP/2 needs httpx, install it with 'pip install httpx[http2]'")
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name="http2-transport", daemon=True)
+        self.__thread.start()
+        self.client = httpx.AsyncClient(
+            http1=not prior_knowledge,
+            http2=True,
+            # Redirects and cookies are handled by the requests session
+            follow_redirects=False,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def __run(self, coroutine: Coroutine) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result()
+
+    @staticmethod
+    def __timeout(timeout: Union[None, float, Tuple[float, float]]) -> "httpx.Timeout":
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout=None, **kwargs) -> requests.Response:
+        httpx_request = self.client.build_request(
+            request.method,
+            request.url,
+            headers=[(k, v) for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS],
+            content=request.body,
+            timeout=self.__timeout(timeout),
+        )
+        with translate_httpx_errors():
+            httpx_response = self.__run(self.client.send(httpx_request, stream=True))
+        response = requests.Response()
+        response.status_code = httpx_response.status_code
+        response.headers = CaseInsensitiveDict(httpx_response.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = HttpxBody(httpx_response, self.__run)
+        response.reason = response.raw.reason
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self) -> None:
+        if self.__loop.is_closed():
+            return
+        self.__run(self.client.aclose())
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+
+
+class PooledSession(requests.Session):
+    """
+    Session shared by every job of a Scrapper run. Connections are kept alive
+    and reused, and each host gets its own pool of at most `pool_maxsize`
+    connections. When `pool_block` is set, workers wait for a free connection
+    instead of opening extra ones that would be discarded afterwards.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int,
+        pool_connections: int = 10,
+        pool_block: bool = True,
+        headers: Optional[dict] = None,
+        on_connect: Optional[Callable[[str, float], None]] = None,
+        http2: bool = False,
+    ) -> None:
+        """
+        on_connect: called with the host and the seconds taken every time a connection is opened
+        http2: sends the requests through Http2Adapter, with prior knowledge for plain http urls.
+        on_connect is not called then. Response bodies must be read to the end: httpx doesn't
+        reset streams closed early, and their unread data stalls the shared connection.
+        """
+        super(PooledSession, self).__init__()
+        self.pool_maxsize = max(1, pool_maxsize)
+        pool_kwargs = dict(
+            pool_connections=pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=pool_block,
+        )
+        adapter = (
+            TimedHTTPAdapter(on_connect, **pool_kwargs)
+            if on_connect is not None
+            else HTTPAdapter(**pool_kwargs)
+        )
+        if http2:
+            self.mount("http://", Http2Adapter(self.pool_maxsize, prior_knowledge=True))
+            self.mount("https://", Http2Adapter(self.pool_maxsize))
+        else:
+            self.mount("http://", adapter)
+            self.mount("https://", adapter)
+        # Headers are set once here so workers never mutate shared session state
+        if headers is not None:
+            self.headers.update(headers)
+
+
+# Statuses of a mirror that is blocking or shedding requests, besides 5xx
+FAILOVER_STATUSES = {403, 429}
+
+
+@dataclass
+class MirrorHealth:
+    # Smoothed seconds to the first byte, None until a request succeeds
+    latency: Optional[float] = None
+    # Smoothed fraction of failed requests
+    error_rate: float = 0.0
+    consecutive_failures: int = 0
+
+    def score(self) -> float:
+        """
+        Expected seconds per successful request, lower is better.
+        """
+        return self.latency / max(1.0 - self.error_rate, 0.05)
+
+
+class MirrorPool:
+    """
+    Base urls serving the same site. Requests to any of them are sent to the
+    fastest healthy one, ranked by the smoothed latency and error rate of the
+    requests themselves and of probes sent in the background. A mirror is
+    left after `max_failures` failures in a row, until a probe succeeds again,
+    and a url that failed on a mirror is retried on another one.
+    """
+
+    def __init__(
+        self,
+        mirrors: List[str],
+        headers: Optional[dict] = None,
+        probe_path: str = "/",
+        probe_interval: float = 30,
+        probe_timeout: float = 5,
+        max_failures: int = 3,
+        smoothing: float = 0.3,
+    ) -> None:
+        """
+        mirrors: base urls like "https://example.com", taken in turns until one is measured
+        smoothing: weight of every new sample in the moving averages
+        """
+        if not mirrors:
+            raise ValueError("A MirrorPool needs at least one mirror")
+        self.mirrors = [mirror.rstrip("/") for mirror in mirrors]
+        self.probe_path = probe_path
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.max_failures = max_failures
+        self.smoothing = smoothing
+        self.session = requests.Session()
+        if headers is not None:
+            self.session.headers.update(headers)
+        self.__health: Dict[str, MirrorHealth] = {mirror: MirrorHealth() for mirror in self.mirrors}
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__probes: List[threading.Thread] = []
+        # Path of a url -> mirror its last request failed on
+        self.__failed_on: Dict[str, str] = {}
+        self.__turn = 0
+
+    def mirror_of(self, url: str) -> Optional[str]:
+        for mirror in self.mirrors:
+            if url == mirror or url.startswith(mirror + "/"):
+                return mirror
+        return None
+
+    def best(self, exclude: Optional[str] = None) -> str:
+        """
+        exclude: mirror to avoid if there is any other
+        """
+        with self.__lock:
+            others = [m for m in self.mirrors if m != exclude] or self.mirrors
+            healthy = [m for m in others if self.__health[m].consecutive_failures < self.max_failures]
+            candidates = healthy or others
+            measured = [m for m in candidates if self.__health[m].latency is not None]
+            if not measured:
+                self.__turn += 1
+                return candidates[self.__turn % len(candidates)]
+            return min(measured, key=lambda m: self.__health[m].score())
+
+    def resolve(self, url: str) -> Tuple[str, Optional[str]]:
+        """
+        The url moved to the best mirror and that mirror, or the url unchanged
+        and None if it isn't on any mirror.
+        """
+        mirror = self.mirror_of(url)
+        if mirror is None:
+            return url, None
+        path = url[len(mirror):]
+        with self.__lock:
+            failed_on = self.__failed_on.get(path)
+        best = self.best(exclude=failed_on)
+        return best + path, best
+
+    def record(
+        self, mirror: str, seconds: Optional[float], status: Optional[int], url: Optional[str] = None
+    ) -> None:
+        """
+        Adds the outcome of a request to mirror, status is None if there was no response.
+        url: the url requested, so a retry after a failure goes to another mirror
+        """
+        failed = status is None or status >= 500 or status in FAILOVER_STATUSES
+        path = url[len(mirror):] if url is not None else None
+        with self.__lock:
+            health = self.__health[mirror]
+            health.error_rate += self.smoothing * (float(failed) - health.error_rate)
+            if failed:
+                health.consecutive_failures += 1
+                if path is not None:
+                    self.__failed_on[path] = mirror
+                return
+            if path is not None:
+                self.__failed_on.pop(path, None)
+            health.consecutive_failures = 0
+            if health.latency is None:
+                health.latency = seconds
+            else:
+                health.latency += self.smoothing * (seconds - health.latency)
+
+    def health(self) -> Dict[str, MirrorHealth]:
+        with self.__lock:
+            return {mirror: replace(health) for mirror, health in self.__health.items()}
+
+    def probe(self, mirror: str) -> None:
+        try:
+            with self.session.get(mirror + self.probe_path, timeout=self.probe_timeout, stream=True) as response:
+                self.record(mirror, response.elapsed.total_seconds(), response.status_code)
+        except requests.RequestException:
+            self.record(mirror, None, None)
+
+    def __probe_periodically(self, mirror: str) -> None:
+        while True:
+            self.probe(mirror)
+            if self.__stopped.wait(self.probe_interval):
+                return
+
+    def start(self) -> None:
+        """
+        Probes every mirror right away and then every `probe_interval` seconds.
+        """
+        self.__stopped.clear()
+        self.__probes = [
+            threading.Thread(target=self.__probe_periodically, args=(mirror,), name="mirror-probe", daemon=True)
+            for mirror in self.mirrors
+        ]
+        for probe in self.__probes:
+            probe.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        for probe in self.__probes:
+            probe.join()
+        self.__probes = []
+        self.session.close()
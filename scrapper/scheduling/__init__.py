@@ -0,0 +1,303 @@
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar, Any, Optional, Union, List
+from concurrent.futures import Executor, Future
+import bisect
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+import requests
+
+from scrapper.utils import ResponseError
+from scrapper.limits import ConcurrencyController
+
+T = TypeVar("T")
+
+# Marks the end of the items flowing between two pipelined jobs
+END_OF_STREAM = object()
+
+
+def iter_queue(source: queue.Queue) -> Iterator[Any]:
+    """
+    Yields the items put in `source` until END_OF_STREAM is received.
+    """
+    while True:
+        item = source.get()
+        if item is END_OF_STREAM:
+            return
+        yield item
+
+
+class ClosableQueue(queue.Queue):
+    """
+    Queue between pipelined jobs whose consumer can stop early. Once closed,
+    the queued items and every later one are dropped, except END_OF_STREAM,
+    so the producer is never blocked on a queue nobody reads anymore.
+    """
+
+    def __init__(self, maxsize: int = 0) -> None:
+        super(ClosableQueue, self).__init__(maxsize)
+        self.closed = False
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> None:
+        if self.closed and item is not END_OF_STREAM:
+            return
+        super(ClosableQueue, self).put(item, block, timeout)
+
+    def close(self) -> None:
+        with self.mutex:
+            self.closed = True
+            ended = any(item is END_OF_STREAM for item in self.queue)
+            self.queue.clear()
+            if ended:
+                self.queue.append(END_OF_STREAM)
+            # Producers waiting for room put their item and see the queue closed afterwards
+            self.not_full.notify_all()
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed request is tried again and after how long.
+    Delays grow exponentially with full jitter, and a Retry-After sent by the
+    server is used as the minimum delay.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        retry_statuses: Iterable[Union[int, str]] = (429, "5xx"),
+        retry_connection_errors: bool = True,
+    ) -> None:
+        """
+        max_attempts: total attempts per request, 1 disables retries
+        backoff: base delay in seconds, doubled on every attempt
+        retry_statuses: status codes or classes like "5xx" worth retrying
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = set()
+        for status in retry_statuses:
+            if isinstance(status, str) and status.lower().endswith("xx"):
+                first = int(status[0]) * 100
+                self.retry_statuses.update(range(first, first + 100))
+            else:
+                self.retry_statuses.add(int(status))
+        self.retry_connection_errors = retry_connection_errors
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, ResponseError):
+            return error.status_code in self.retry_statuses
+        return self.retry_connection_errors and isinstance(
+            error,
+            (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ),
+        )
+
+    def next_delay(self, attempt: int, error: BaseException) -> Optional[float]:
+        """
+        Seconds to wait before the next attempt, or None if `attempt` was the last one.
+        """
+        if attempt >= self.max_attempts or not self.is_retryable(error):
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+
+def iter_completed(
+    executor: Executor,
+    fn: Callable[[T], Any],
+    items: Iterable[T],
+    window: int,
+    retry_policy: Optional[RetryPolicy] = None,
+    concurrency: Optional[ConcurrencyController] = None,
+) -> Iterator[Tuple[T, Future]]:
+    """
+    Submits fn(item) for every item, keeping at most `window` of them in flight,
+    and yields (item, future) pairs as soon as each one finishes.
+    Items are read from a separate thread, so a slow or blocking `items` iterable
+    (e.g. a queue fed by another job) never delays the results already available.
+    Failures accepted by `retry_policy` are submitted again once their delay is
+    over, without any thread waiting for it. Only the last attempt is yielded.
+    With a `concurrency` controller the window follows its limit, and the
+    outcome of every attempt is reported to it.
+    """
+    slots = threading.Condition()
+    slot_state = dict(in_flight=0)
+    completed: queue.Queue = queue.Queue()
+    stopped = threading.Event()
+    feed_state = dict(submitted=0, error=None)
+    # (due time, tie breaker, item, attempt)
+    retries: List[Tuple[float, int, T, int]] = []
+    sequence = itertools.count()
+
+    def current_window() -> int:
+        return max(1, concurrency.limit if concurrency is not None else window)
+
+    def acquire_slot() -> None:
+        with slots:
+            while slot_state["in_flight"] >= current_window() and not stopped.is_set():
+                slots.wait()
+            slot_state["in_flight"] += 1
+
+    def release_slot() -> None:
+        with slots:
+            slot_state["in_flight"] -= 1
+            slots.notify()
+
+    def submit(item: T, attempt: int) -> None:
+        submitted_at = time.monotonic()
+        future = executor.submit(fn, item)
+        future.add_done_callback(
+            lambda f: completed.put((item, attempt, time.monotonic() - submitted_at, f))
+        )
+
+    def feed() -> None:
+        try:
+            for item in items:
+                acquire_slot()
+                if stopped.is_set():
+                    return
+                submit(item, 1)
+                feed_state["submitted"] += 1
+        except Exception as e:
+            feed_state["error"] = e
+        finally:
+            completed.put(END_OF_STREAM)
+
+    threading.Thread(target=feed, daemon=True).start()
+    received = 0
+    feeding = True
+    try:
+        while feeding or received < feed_state["submitted"]:
+            timeout = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+            try:
+                entry = completed.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+            while retries and retries[0][0] <= time.monotonic():
+                _, _, item, attempt = heapq.heappop(retries)
+                submit(item, attempt)
+            if entry is None:
+                continue
+            if entry is END_OF_STREAM:
+                feeding = False
+                continue
+            item, attempt, latency, future = entry
+            error = future.exception() if not future.cancelled() else None
+            if concurrency is not None:
+                concurrency.record(latency, error)
+                with slots:
+                    # The limit may have grown
+                    slots.notify_all()
+            delay = retry_policy.next_delay(attempt, error) if retry_policy is not None and error is not None else None
+            if delay is not None:
+                # The item keeps its slot while it waits
+                heapq.heappush(retries, (time.monotonic() + delay, next(sequence), item, attempt + 1))
+                continue
+            received += 1
+            release_slot()
+            yield item, future
+    finally:
+        # Unblocks the feeder if the consumer stops early
+        stopped.set()
+        with slots:
+            slots.notify_all()
+    if feed_state["error"] is not None:
+        raise feed_state["error"]
+
+
+SIZE_POLICIES = ("smallest", "largest", "interleave")
+
+
+def iter_by_size(
+    items: Iterable[T],
+    size_of: Callable[[T], Optional[int]],
+    policy: str,
+    lookahead: int,
+    executor: Executor,
+) -> Iterator[T]:
+    """
+    Yields items reordered by the size returned by size_of, which runs on
+    `executor` for up to `lookahead` items read ahead of the consumer. Every
+    time the consumer asks for an item, the best one among those already sized
+    is picked: the smallest, the largest, or alternately one of each with
+    "interleave". Items whose size is unknown (None) come after the sized ones.
+    """
+    if policy not in SIZE_POLICIES:
+        raise ValueError(f"Unknown size policy {policy}, expected one of {SIZE_POLICIES}")
+    lookahead = max(1, lookahead)
+    changed = threading.Condition()
+    # (size, tie breaker, item), kept sorted
+    sized: List[Tuple[int, int, T]] = []
+    unsized: List[T] = []
+    state = dict(probing=0, done=False, stopped=False, error=None)
+    sequence = itertools.count()
+
+    def buffered() -> int:
+        return len(sized) + len(unsized)
+
+    def on_sized(item: T, future: Future) -> None:
+        size = future.result() if future.exception() is None else None
+        with changed:
+            state["probing"] -= 1
+            if size is None:
+                unsized.append(item)
+            else:
+                bisect.insort(sized, (size, next(sequence), item))
+            changed.notify_all()
+
+    def read() -> None:
+        try:
+            for item in items:
+                with changed:
+                    while buffered() + state["probing"] >= lookahead and not state["stopped"]:
+                        changed.wait()
+                    if state["stopped"]:
+                        return
+                    state["probing"] += 1
+                future = executor.submit(size_of, item)
+                future.add_done_callback(lambda f, item=item: on_sized(item, f))
+        except Exception as e:
+            state["error"] = e
+        finally:
+            with changed:
+                state["done"] = True
+                changed.notify_all()
+
+    threading.Thread(target=read, daemon=True).start()
+    take_largest = policy == "largest"
+    try:
+        while True:
+            with changed:
+                # Waits for half a window so the choice is made among several sizes
+                while not (
+                    (state["done"] and state["probing"] == 0)
+                    or (buffered() > 0 and (state["probing"] == 0 or buffered() >= lookahead // 2))
+                ):
+                    changed.wait()
+                if buffered() == 0:
+                    break
+                if sized:
+                    item = sized.pop(-1 if take_largest else 0)[2]
+                    if policy == "interleave":
+                        take_largest = not take_largest
+                else:
+                    item = unsized.pop(0)
+                changed.notify_all()
+            yield item
+    finally:
+        with changed:
+            state["stopped"] = True
+            changed.notify_all()
+    if state["error"] is not None:
+        raise state["error"]
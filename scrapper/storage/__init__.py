@@ -0,0 +1,267 @@
+from typing import Set, Dict, Tuple, Optional, Union, List, Iterator
+from pathlib import Path
+from urllib.parse import urlsplit
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from scrapper.utils import StatsJournal
+
+
+class FileNameAllocator:
+    """
+    Hands out '{base_name}-NNNN.ext' names in a directory. The directory is scanned
+    once and the numbers already in use are kept in memory, so allocating a name
+    never touches the filesystem.
+    """
+
+    def __init__(self, directory: str, base_name: str, append_files: bool = True) -> None:
+        self.directory = directory
+        self.base_name = base_name
+        self.append_files = append_files
+        self.__used: Set[int] = set()
+        self.__offset = 0
+        self.__lock = threading.Lock()
+        if append_files and os.path.isdir(directory):
+            # Partial downloads ('name.ext.part') also hold their number
+            pattern = re.compile(rf"^{re.escape(base_name)}-(\d+)\.")
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    match = pattern.match(entry.name)
+                    if match is not None:
+                        self.__used.add(int(match.group(1)))
+
+    def allocate(self, index: int, extension: str) -> str:
+        """
+        Returns the path for the file at position `index` of the input.
+        When appending, the first free number from `index` on is used. Numbers
+        only grow, so the skipped ones are never checked again.
+        """
+        with self.__lock:
+            if self.append_files:
+                while index + self.__offset in self.__used:
+                    self.__offset += 1
+                self.__used.add(index + self.__offset)
+            return os.path.join(
+                self.directory,
+                f"{self.base_name}-{index + self.__offset:04d}.{extension}",
+            )
+
+
+class ContentStore:
+    """
+    Index of downloaded files by content digest, meant to be shared by every
+    album of a download. Files already in the store are hardlinked into place
+    (or skipped) instead of being written again.
+    """
+
+    def __init__(self, index_path: Union[str, Path], algorithm: str = "sha256", mode: str = "link") -> None:
+        """
+        index_path: journal where the digests are persisted between runs
+        mode: 'link' hardlinks duplicates into their destination, 'skip' doesn't create them at all
+        """
+        if mode not in ("link", "skip"):
+            raise ValueError(f"Unrecognized mode {mode}. Accepted values are 'link' and 'skip'")
+        self.algorithm = algorithm
+        self.mode = mode
+        self.__journal = StatsJournal(Path(index_path))
+        self.__paths: Dict[str, str] = {}  # digest -> path of the stored copy
+        self.__by_url: Dict[str, str] = {}  # url -> digest
+        self.__by_name: Dict[Tuple[str, int], str] = {}  # (file name, size) -> digest
+        self.__lock = threading.Lock()
+        for entry in self.__journal.read():
+            self.__index_entry(entry)
+
+    @staticmethod
+    def __url_name(url: str) -> str:
+        return os.path.basename(urlsplit(url).path)
+
+    def __index_entry(self, entry: dict) -> None:
+        digest = entry["digest"]
+        if entry.get("path") is not None:
+            self.__paths[digest] = entry["path"]
+        self.__by_url[entry["url"]] = digest
+        if entry.get("size") is not None:
+            self.__by_name[(self.__url_name(entry["url"]), entry["size"])] = digest
+
+    def __stored_path(self, digest: Optional[str]) -> Optional[str]:
+        path = self.__paths.get(digest) if digest is not None else None
+        # Files removed by the user after being indexed don't count
+        return path if path is not None and os.path.exists(path) else None
+
+    def new_hash(self) -> "hashlib._Hash":
+        return hashlib.new(self.algorithm)
+
+    def find(self, url: str, size: Optional[int] = None) -> Optional[str]:
+        """
+        Path of a stored file for url, matched by the url itself or, when the size
+        is known before downloading, by the file name and size.
+        """
+        with self.__lock:
+            path = self.__stored_path(self.__by_url.get(url))
+            if path is None and size is not None:
+                path = self.__stored_path(self.__by_name.get((self.__url_name(url), size)))
+            return path
+
+    def find_digest(self, digest: str) -> Optional[str]:
+        with self.__lock:
+            return self.__stored_path(digest)
+
+    def add(self, url: str, digest: str, size: int, path: Optional[str] = None) -> None:
+        """
+        Records the content of url. `path` is only given for files actually written.
+        """
+        entry = dict(url=url, digest=digest, size=size)
+        if path is not None:
+            entry["path"] = os.path.abspath(path)
+        with self.__lock:
+            self.__index_entry(entry)
+        self.__journal.append(entry)
+
+    def place(self, stored_path: str, path: str) -> bool:
+        """
+        Makes the stored file available at `path`. Returns False if that was not
+        possible (e.g. a hardlink across filesystems) and the file must be written.
+        """
+        if self.mode == "skip" or os.path.abspath(stored_path) == os.path.abspath(path):
+            return True
+        try:
+            os.link(stored_path, path)
+        except OSError:
+            return False
+        return True
+
+
+class PartialDownload:
+    """
+    Unfinished download kept on disk as '<path><suffix>', next to a JSON sidecar
+    with the url, the bytes received and the validators (ETag/Last-Modified)
+    needed to continue it with a Range request.
+    """
+
+    def __init__(self, path: str, url: str, suffix: str = ".part") -> None:
+        self.url = url
+        self.tmp_path = path + suffix
+        self.sidecar_path = self.tmp_path + ".json"
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        # Only set for segmented downloads, where the file is preallocated to `size`
+        self.size: Optional[int] = None
+        self.completed_segments: Optional[List[Tuple[int, int]]] = None
+        self.__lock = threading.Lock()
+
+    def load(self) -> int:
+        """
+        Returns the amount of bytes that can be resumed, 0 if the partial file
+        is missing or belongs to another url.
+        """
+        if not (os.path.exists(self.tmp_path) and os.path.exists(self.sidecar_path)):
+            return 0
+        try:
+            with open(self.sidecar_path, "r") as file:
+                meta = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return 0
+        if meta.get("url") != self.url:
+            return 0
+        self.etag = meta.get("etag")
+        self.last_modified = meta.get("last_modified")
+        if meta.get("segments") is not None:
+            # The file is preallocated, its size says nothing about the bytes received
+            self.size = meta.get("size")
+            self.completed_segments = [tuple(segment) for segment in meta["segments"]]
+            return 0
+        # The data on disk is what was actually received, even if the sidecar is behind
+        return os.path.getsize(self.tmp_path)
+
+    def range_headers(self, offset: int) -> Dict[str, str]:
+        headers = {"Range": f"bytes={offset}-"}
+        # Weak ETags can't be used in If-Range
+        strong_etag = self.etag if self.etag is not None and not self.etag.startswith("W/") else None
+        validator = strong_etag if strong_etag is not None else self.last_modified
+        if validator is not None:
+            # The server answers with the whole file if it changed since
+            headers["If-Range"] = validator
+        return headers
+
+    def save(self, received: int) -> None:
+        meta = dict(
+            url=self.url,
+            bytes=received,
+            etag=self.etag,
+            last_modified=self.last_modified,
+        )
+        with self.__lock:
+            if self.completed_segments is not None:
+                meta["size"] = self.size
+                meta["segments"] = self.completed_segments
+            with open(self.sidecar_path, "w") as file:
+                json.dump(meta, file)
+
+    def start_segments(self, size: int) -> None:
+        if self.completed_segments is None or self.size != size:
+            self.completed_segments = []
+        self.size = size
+
+    def complete_segment(self, start: int, end: int) -> None:
+        with self.__lock:
+            self.completed_segments.append((start, end))
+        self.save(sum(end - start + 1 for start, end in self.completed_segments))
+
+    def finish(self) -> None:
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+
+    def discard(self) -> None:
+        for file_path in (self.tmp_path, self.sidecar_path):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+class UrlSpool:
+    """
+    Append-only list of urls kept in an anonymous temporary file instead of
+    memory, removed by the system once the spool is closed or collected.
+    It can be iterated several times, also while urls are being appended.
+    """
+
+    def __init__(self, directory: Optional[str] = None, read_size: int = 64 * 1024) -> None:
+        self.read_size = read_size
+        self.__file = tempfile.TemporaryFile(dir=directory)
+        self.__length = 0
+        self.__lock = threading.Lock()
+
+    def append(self, url: str) -> None:
+        line = (url + "\n").encode("utf-8")
+        with self.__lock:
+            self.__file.seek(0, os.SEEK_END)
+            self.__file.write(line)
+            self.__length += 1
+
+    def extend(self, urls: List[str]) -> None:
+        for url in urls:
+            self.append(url)
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def __iter__(self) -> Iterator[str]:
+        position = 0
+        rest = b""
+        while True:
+            with self.__lock:
+                self.__file.seek(position)
+                block = self.__file.read(self.read_size)
+            if not block:
+                return
+            position += len(block)
+            lines = (rest + block).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line.decode("utf-8")
+
+    def close(self) -> None:
+        self.__file.close()
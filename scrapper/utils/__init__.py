@@ -1,10 +1,16 @@
 from tqdm import tqdm
-from typing import Optional, List
+from typing import Optional, List, Iterable, Iterator, Callable, Dict, Set, TypeVar
 from requests import Response
+from bs4 import SoupStrainer
+from bs4.builder import builder_registry
 import json
+import os
+import threading
 from pathlib import Path
 import re
 import unicodedata
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 def slugify(value):
     """
@@ -22,12 +28,112 @@ def slugify(value):
     value = value.strip('-')
     return value
 
+def resolve_html_parser(html_parser: str) -> str:
+    """
+    Returns `html_parser` if its backend is installed, otherwise the builtin parser.
+    """
+    if builder_registry.lookup(html_parser) is None:
+        print(f"HTML parser {html_parser} is not available, using html.parser")
+        return "html.parser"
+    return html_parser
+
+def parses_only(*strainers: SoupStrainer) -> Callable:
+    """
+    Declares the only elements an extractor needs, so the rest of the page is not
+    parsed. When several strainers are given they are tried in order until the
+    extractor succeeds.
+    """
+    def decorator(job: Callable) -> Callable:
+        job.parse_only = list(strainers)
+        return job
+    return decorator
+
+class RangeNotSupported(Exception):
+    pass
+
+class ResponseError(Exception):
+    def __init__(self, response: Response) -> None:
+        # aiohttp responses name it status
+        status_code = getattr(response, "status_code", None) or response.status
+        super(ResponseError, self).__init__(f"Error on request, obtained: {status_code}")
+        self.status_code = status_code
+        self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+T = TypeVar("T")
+
+
+def rereadable(items: Iterable[T]) -> Iterable[T]:
+    """
+    items in an iterable that can be read more than once, one-shot iterators
+    like generators are read into a list.
+    """
+    return list(items) if iter(items) is items else items
+
 def check_response(response: Response):
     if not response.ok:
-        raise Exception(f"Error on request, obtained: {response.status_code}")
+        raise ResponseError(response)
+
+
+def __parse_content_range(response: Response) -> Optional[re.Match]:
+    return re.match(r"bytes\s+(\d+|\*)-?(\d*)/(\d+|\*)", response.headers.get("Content-Range", ""))
+
+def content_range_start(response: Response) -> Optional[int]:
+    match = __parse_content_range(response)
+    return int(match.group(1)) if match is not None and match.group(1) != "*" else None
+
+def content_range_total(response: Response) -> Optional[int]:
+    match = __parse_content_range(response)
+    return int(match.group(3)) if match is not None and match.group(3) != "*" else None
+
+def hash_file(hasher, path: str, buffer_size: int = 64 * 1024) -> None:
+    """
+    Feeds the contents of the file at path into hasher.
+    """
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(buffer_size), b""):
+            hasher.update(chunk)
+
+
+class Counter:
+    """
+    Integer that can be incremented from several threads without losing updates.
+    """
+
+    def __init__(self, value: int = 0) -> None:
+        self.__value = value
+        self.__lock = threading.Lock()
+
+    def increment(self, amount: int = 1) -> int:
+        with self.__lock:
+            self.__value += amount
+            return self.__value
+
+    @property
+    def value(self) -> int:
+        return self.__value
 
 
 class ShowsProgress:
+    """
+    Workers only increment counters, the progress bar is redrawn from them
+    every `progress_interval` seconds by a separate thread.
+    """
+
     def __init__(self, *args, **kwargs) -> None:
         try:
             super(ShowsProgress, self).__init__(**kwargs)
@@ -35,43 +141,124 @@ class ShowsProgress:
             super(ShowsProgress, self).__init__()
         self.pbar: Optional[tqdm] = None
         self.last_fail: int = 1
-        self.progress = dict(tries=0, fails=0)
+        self.progress = dict(tries=Counter(), fails=Counter())
+        self.progress_interval: float = kwargs.get("progress_interval", 0.2)
         self.__base_description = ""
-        self.__last_progress_update = 0
+        self.__progress_total = Counter()
+        self.__progress_start = 0
+        self.__render_lock = threading.Lock()
+        self.__render_stopped = threading.Event()
+        self.__render_thread: Optional[threading.Thread] = None
 
     def init_progress_bar(self, total: int, base_description) -> None:
-        self.pbar = None  # Clear variable
+        self.clear_progress_bar()
         self.pbar = tqdm(total=total, desc=base_description, colour='#a970ff', iterable=True)
         self.__base_description = base_description
+        self.__progress_total = Counter(total)
+        self.__progress_start = self.get_tries()
+        self.__render_stopped = threading.Event()
+        self.__render_thread = threading.Thread(
+            target=self.__render_periodically, args=(self.__render_stopped,), daemon=True
+        )
+        self.__render_thread.start()
+
+    def __render_periodically(self, stopped: threading.Event) -> None:
+        while not stopped.wait(self.progress_interval):
+            self.update_progress_bar()
 
     def update_progress_bar(self):
-        if self.pbar is not None:
-            update_delta = self.progress["tries"] - self.__last_progress_update
+        with self.__render_lock:
+            if self.pbar is None:
+                return
             if self.get_fails() > self.last_fail:
                 self.pbar.set_description(
-                    f"{self.__base_description} ({self.progress['fails']} fails)"
+                    f"{self.__base_description} ({self.get_fails()} fails)", refresh=False
                 )
                 self.last_fail = self.get_fails()
-            self.pbar.update(n=update_delta)
-            self.__last_progress_update = self.progress["tries"]
+            self.pbar.total = self.__progress_total.value
+            self.pbar.n = self.get_tries() - self.__progress_start
+            self.pbar.refresh()
+
+    def extend_progress_total(self, amount: int) -> None:
+        self.__progress_total.increment(amount)
+
+    def count_progress_total(self, items: Iterable[str]) -> Iterator[str]:
+        """
+        Grows the progress bar total as items arrive, for inputs of unknown length.
+        """
+        for item in items:
+            self.extend_progress_total(1)
+            yield item
 
     def clear_progress_bar(self):
+        if self.__render_thread is not None:
+            self.__render_stopped.set()
+            self.__render_thread.join()
+            self.__render_thread = None
         if self.pbar is not None:
-            self.pbar.close()
+            self.update_progress_bar()
+            with self.__render_lock:
+                self.pbar.close()
+                self.pbar = None
 
     def advance_progress(self, update_pbar=True):
-        self.progress["tries"] += 1
-        if update_pbar:
-            self.update_progress_bar()
+        """
+        update_pbar is kept for compatibility, the bar is redrawn on a timer.
+        """
+        self.progress["tries"].increment()
 
     def add_fail(self):
-        self.progress["fails"] += 1
+        self.progress["fails"].increment()
 
     def get_fails(self) -> int:
-        return self.progress["fails"]
+        return self.progress["fails"].value
 
     def get_tries(self) -> int:
-        return self.progress["tries"]
+        return self.progress["tries"].value
+
+
+class StatsJournal:
+    """
+    Append-only file with one JSON entry per line. Lines that can't be parsed,
+    like the last one after a crash in the middle of a write, are ignored.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.__file = None
+        self.__lock = threading.Lock()
+
+    def read(self) -> Iterator[dict]:
+        if not self.path.exists():
+            return
+        with self.path.open("r") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def append(self, entry: dict) -> None:
+        with self.__lock:
+            if self.__file is None:
+                self.__file = self.path.open("a")
+                # Terminates a line left incomplete by a crash so it doesn't swallow this entry
+                if self.__file.tell() > 0 and not self.__ends_with_newline():
+                    self.__file.write("\n")
+            self.__file.write(json.dumps(entry) + "\n")
+            self.__file.flush()
+
+    def __ends_with_newline(self) -> bool:
+        with self.path.open("rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def clear(self) -> None:
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+            self.path.unlink(missing_ok=True)
 
 
 class HasStats:
@@ -81,6 +268,8 @@ class HasStats:
         except TypeError:
             super(HasStats, self).__init__()
         self.save_stats = kwargs.get("save_stats", False)
+        # Entries appended to the journal before it is folded into the stats file
+        self.stats_compact_every: int = kwargs.get("stats_compact_every", 1000)
         
         self.stats_output_dir: Optional[Path] = Path(kwargs.get("stats_output_dir")) if kwargs.get("stats_output_dir") is not None else None
         self.stats_filename: Optional[Path] = Path(kwargs.get("stats_filename")) if kwargs.get("stats_filename") is not None else None
@@ -98,19 +287,47 @@ class HasStats:
                 self.stats_filename = Path(f"{slugify(n)}-stats.json")
             except:
                 self.stats_filename = Path('stats.json')
-        
-        if self.stats_output_dir is not None and self.stats_filename is not None and self.stats_output_dir.joinpath(self.get_filename()).exists():
-            with self.stats_output_dir.joinpath(self.stats_filename).open("r") as file:
-                # print("Loading stats from file", file.name)
-                self.stats = json.load(file)
+
+        self.stats = dict(tries=0, fails=0)
+        # url -> entry, with the failed ones also indexed on their own
+        self.__urls: Dict[str, dict] = {}
+        self.__failed_urls: Set[str] = set()
+        self.__journal: Optional[StatsJournal] = None
+        self.__journal_entries = 0
+
+        if self.stats_output_dir is not None and self.stats_filename is not None:
+            stats_filepath = self.stats_output_dir.joinpath(self.get_filename())
+            if stats_filepath.exists():
+                with stats_filepath.open("r") as file:
+                    for entry in json.load(file)["urls"]:
+                        self.__index_entry(entry)
+            for entry in self.__get_journal().read():
+                self.__index_entry(entry)
+
+    def __index_entry(self, entry: dict) -> None:
+        url = entry["value"]
+        self.__urls.pop(url, None)
+        self.__urls[url] = entry
+        if entry["processed"]:
+            self.__failed_urls.discard(url)
         else:
-            # print("Creating new stats")
-            self.stats = dict(tries=0, fails=0, urls=[])
+            self.__failed_urls.add(url)
+        self.stats["tries"] = len(self.__urls)
+        self.stats["fails"] = len(self.__failed_urls)
+
+    def __get_journal(self) -> StatsJournal:
+        if self.__journal is None:
+            self.__journal = StatsJournal(self.get_stats_filepath().with_suffix(".jsonl"))
+        return self.__journal
 
     def remove_failed_urls(self) -> None:
-        self.stats["urls"] = [url for url in self.stats["urls"] if url["processed"]]
-        self.stats['tries'] -= self.stats['fails']
+        for url in self.__failed_urls:
+            self.__urls.pop(url)
+        self.__failed_urls.clear()
+        self.stats['tries'] = len(self.__urls)
         self.stats['fails'] = 0
+        if self.save_stats:
+            self.save_stats_in_file()
 
     def get_filename(self) -> Path:
         if self.stats_filename is not None:
@@ -128,10 +345,21 @@ class HasStats:
         return self.stats
     
     def get_all_urls(self) -> List[str]:
-        return [url["value"] for url in self.stats["urls"]]
+        return list(self.__urls.keys())
 
     def get_failed_urls(self) -> List[str]:
-        return [url["value"] for url in self.stats["urls"] if not url["processed"]]
+        return list(self.__failed_urls)
+
+    def is_processed(self, url: str) -> bool:
+        entry = self.__urls.get(url)
+        return entry is not None and entry["processed"]
+
+    def get_outputs(self, url: str) -> Optional[List[str]]:
+        """
+        Returns the outputs recorded for url, or None if nothing was recorded.
+        """
+        entry = self.__urls.get(url)
+        return entry.get("outputs") if entry is not None else None
 
     def opt_set_stats_output_dir(self, dir: str) -> None:
         if self.stats_output_dir is None:
@@ -145,18 +373,31 @@ class HasStats:
         self.opt_set_stats_output_dir('./')
         return Path(self.stats_output_dir).joinpath(self.get_filename())
         
-    def add_stat(self, url: str, success: bool):
+    def add_stat(self, url: str, success: bool, outputs: Optional[List[str]] = None):
         if not self.save_stats:
             return
-        self.stats["tries"] += 1
-        self.stats["fails"] += 1 if not success else 0
-        self.stats["urls"].append(dict(value=url, processed=success))
+        entry = dict(value=url, processed=success)
+        if outputs is not None:
+            entry["outputs"] = outputs
+        self.__index_entry(entry)
+        self.__get_journal().append(entry)
+        self.__journal_entries += 1
+        if self.__journal_entries >= self.stats_compact_every:
+            self.save_stats_in_file()
 
     def save_stats_in_file(self):
+        """
+        Compacts the journal: writes every url into the stats file and starts a new journal.
+        """
         if not self.save_stats:
             return
-        with self.get_stats_filepath().open("w+") as file:
-            json.dump(self.stats, file, indent=4)
+        stats_filepath = self.get_stats_filepath()
+        tmp_filepath = stats_filepath.with_suffix(".json.tmp")
+        with tmp_filepath.open("w+") as file:
+            json.dump(dict(**self.stats, urls=list(self.__urls.values())), file, indent=4)
+        os.replace(tmp_filepath, stats_filepath)
+        self.__get_journal().clear()
+        self.__journal_entries = 0
 
 
 class NamedResource:
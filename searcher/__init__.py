@@ -7,6 +7,7 @@ from dataclasses import dataclass, asdict
 from io_utils.json import JSONable, JSONableDataclass
 from typing_extensions import Self
 from searcher.download.bunkr import prepare_bunkr_scrapper
+from scrapper.utils import resolve_html_parser
 import re
 from time import time
 from .utils import parse_download_name, parse_size_name, parse_size_bytes,Color
@@ -17,6 +18,7 @@ from functools import reduce
 class Config:
     downloads: Path = Path('./output')
     cache: Path = Path('./cache')
+    html_parser: str = 'lxml'
 
 def load_config(config_path: Path) -> Config:
     if not config_path.exists():
@@ -25,7 +27,8 @@ def load_config(config_path: Path) -> Config:
         c = json.load(file)
         return Config(
             downloads=Path(c['downloads']),
-            cache=Path(c['cache'])
+            cache=Path(c['cache']),
+            html_parser=resolve_html_parser(c.get('html_parser', Config.html_parser))
         )
 
 @dataclass
@@ -96,7 +99,7 @@ def get_downloaded(downloaded_path = 'output/downloaded.json') -> List[str]:
         downloaded_list = json.load(file)
         return downloaded_list
 
-def cook_soup(url: str) -> BeautifulSoup:
+def cook_soup(url: str, html_parser: str = 'html.parser') -> BeautifulSoup:
     res = requests.get(
         url,
         headers={
@@ -105,7 +108,7 @@ def cook_soup(url: str) -> BeautifulSoup:
         )
     if not res.ok:
         raise Exception(f'Response returned error status {res.status_code}: {res.text}')
-    return BeautifulSoup(res.text, 'html.parser')
+    return BeautifulSoup(res.content, html_parser)
 
 @dataclass
 class BunkrSearch(JSONable):
@@ -206,12 +209,12 @@ class BunkrSearcher:
     def search(self, query: str, save: bool = True, max_loaded_pages: int = 1) -> BunkrSearch:
         search_result: BunkrSearch = self.cache.get(query, BunkrSearch(query,{},0,0), BunkrSearch)
         if search_result.total_pages == None:
-            soup = cook_soup(self.__build_url(query))
+            soup = cook_soup(self.__build_url(query), self.config.html_parser)
             search_result.total_pages = self.__get_pages_amount(soup)
         for page in range(1, max_loaded_pages+1):
             if page <= search_result.pages and search_result.results[page] != []:
                 continue
-            l = self.__get_result_links(cook_soup(self.__build_url(query, page)))
+            l = self.__get_result_links(cook_soup(self.__build_url(query, page), self.config.html_parser))
             albums = [self.__get_album_info(link.url) for link in l]
             
             search_result.results[page] = albums
@@ -241,7 +244,7 @@ class BunkrSearcher:
         return downloads
 
     def __get_album_info(self, url: str) -> AlbumInfo:
-        soup = cook_soup(url)
+        soup = cook_soup(url, self.config.html_parser)
         header_div = soup.find('div', class_='mb-12-xxx')
         if header_div is None:
             raise Exception('Header div not found for album', url)
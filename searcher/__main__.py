@@ -21,6 +21,13 @@ def prepare_parser() -> ArgumentParser:
     parser.add_argument('--content-dir',type=str,help='Path to the downloaded content. This path must be relative to the output directory path.')
     parser.add_argument('-M','--max-total-size',type=str,help='Max total size to download (1 KB = 1024 B)')
     parser.add_argument('-m','--max-album-size',type=str,help='Max size for an album to download it (1 KB = 1024 B)')
+    parser.add_argument('-b','--bandwidth',type=str,help='Max download speed per second, shared by every album (1 KB = 1024 B)')
+    parser.add_argument('-w','--workers',type=int,default=16,help='Requests in flight, per album or shared by the parallel albums')
+    parser.add_argument('--request-cooldown',type=float,default=0.8,help='Seconds between the requests of every worker, 0 disables the rate limit')
+    parser.add_argument('-p','--parallel-albums',type=int,default=1,help='Albums downloaded at the same time, sharing the same workers')
+    parser.add_argument('--http2',action='store_true',help='Fetches the album and file pages over a few multiplexed HTTP/2 connections, needs httpx[http2]')
+    parser.add_argument('--mirrors',type=str,nargs='+',help='Other bunkr domains serving the same albums, like https://bunkrrr.org. Pages are requested from the fastest one that works')
+    parser.add_argument('--thumbnails',action='store_true',help='Downloads only the thumbnails shown in the album pages instead of the files')
     parser.add_argument('-f','--filter-download',type=str,help='When downloading, filter the downloaded albums by this string as a regular expression.')
     parser.add_argument('--merge-expr',type=str,default=None,help='Regular expression to extract the name of the album from the url. This is used to merge the results into a single download.')
 
@@ -39,7 +46,7 @@ def main():
         print(result)
     
     if args.download:
-        downloader = BunkrDownloader()
+        downloader = BunkrDownloader(config.html_parser)
         downloader.download(
             result, 
             config.downloads if args.output_dir is None else Path(args.output_dir), 
@@ -48,7 +55,14 @@ def main():
             args.max_album_size, 
             args.filter_download, 
             args.merge_expr,
-            args.verbose
+            args.verbose,
+            bandwidth=args.bandwidth,
+            parallel_albums=args.parallel_albums,
+            http2=args.http2,
+            mirrors=args.mirrors,
+            thumbnails=args.thumbnails,
+            max_workers=args.workers,
+            request_cooldown=args.request_cooldown
             )
 
 if __name__ == '__main__':
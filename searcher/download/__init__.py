@@ -1,28 +1,45 @@
-from typing import List, Set, Iterable, Optional, Dict, Union
+from __future__ import annotations
+from typing import List, Set, Iterable, Optional, Dict, Union, TYPE_CHECKING
 from pathlib import Path
-from searcher.download.bunkr import prepare_bunkr_scrapper
+from searcher.download.bunkr import prepare_bunkr_scrapper, prepare_album_pool, prepare_mirror_pool
+from concurrent.futures import ThreadPoolExecutor
+from scrapper.storage import ContentStore
+from scrapper.limits import TokenBucket, ByteBudget
 import re
 
-from .. import BunkrSearch, AlbumInfo
+# searcher imports this package while it is being initialized
+if TYPE_CHECKING:
+    from .. import BunkrSearch, AlbumInfo
 from ..utils import parse_size_name, parse_download_name, parse_size_bytes
 
 class BunkrDownloader:
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, html_parser: str = 'lxml') -> None:
+        self.html_parser = html_parser
 
     def download(
             self,
             search: BunkrSearch, 
             output_path: Path, content_path: Optional[Path]=None, max_size: Optional[str]=None, max_album_size: Optional[str]=None,
             filter_query: Optional[str]=None, merge_query: Optional[str]=None,
-            verbose=False):
-    
+            verbose=False, deduplicate=True, bandwidth: Optional[str]=None, parallel_albums: int=1,
+            http2: bool=False, mirrors: Optional[List[str]]=None, thumbnails: bool=False,
+            max_workers: int=16, request_cooldown: float=0.8):
+        """
+        max_size is enforced on the bytes actually downloaded, shared by every album.
+        bandwidth: max download speed per second like "2 MB", shared by every album.
+        parallel_albums: albums downloaded at the same time on one shared pool of workers.
+        http2: page requests share a few multiplexed HTTP/2 connections (needs httpx[http2]).
+        mirrors: other bunkr domains, album and file pages are requested from the fastest one.
+        thumbnails: downloads only the thumbnails shown in the album pages.
+        max_workers and request_cooldown bound the requests of every album, or of all of them
+        together with parallel_albums. A request_cooldown of 0 disables the rate limit.
+        """
+
         if not output_path.is_dir():
             raise ValueError(f'Ouptut path {output_path} is not a directory.')
         max_size_int = parse_size_name(max_size) if max_size is not None else None
         max_album_size_int = parse_size_name(max_album_size) if max_album_size is not None else None
-        acum_size = 0
         results: Dict[str, List[AlbumInfo]] = dict()  
         for res in search.get_albums():
             if (filter_query is not None) and re.search(filter_query, res.name) is None:
@@ -35,14 +52,9 @@ class BunkrDownloader:
                 if verbose:
                     print(f'Skipping {res.name} because it exceeded the max size for an album')
                 continue
-            if max_size is not None and (acum_size + result_size) > max_size_int:
-                if verbose:
-                    print(f'Skipping {res.name} because it will exceed the max download size')
-                continue
             
             if verbose:
                 print(f'Added {res.name} to downloads')
-            acum_size += result_size
             m = re.match(merge_query, res.name) if merge_query is not None else None
             key = res.name if m is None else res.name[m.start():m.end()]
             results.setdefault(key, []).append(res)
@@ -50,6 +62,39 @@ class BunkrDownloader:
 
         results_len = len(results.keys())
         print(f'Downloading {results_len} album{"s" if results_len > 1 else ""} into {output_path}')
-        for name, res in results.items():
+        # Files repeated across albums are stored once and hardlinked into each album
+        content_store = ContentStore(output_path.joinpath('content-index.jsonl')) if deduplicate else None
+        bandwidth_int = parse_size_name(bandwidth) if bandwidth is not None else None
+        # One second worth of bytes can be received at once
+        bandwidth_limiter = TokenBucket(bandwidth_int, bandwidth_int) if bandwidth_int is not None else None
+        byte_budget = ByteBudget(max_size_int) if max_size_int is not None else None
+        album_pool = prepare_album_pool(max_workers, request_cooldown, http2=http2) if parallel_albums > 1 else None
+        mirror_pool = prepare_mirror_pool(mirrors) if mirrors else None
+
+        def download_album(name: str, res: List[AlbumInfo]) -> None:
+            if byte_budget is not None and byte_budget.closed:
+                print(f'Skipping {name} because the max download size was reached')
+                return
             safe_name = name.replace('/', '|').replace('.', '_')
-            prepare_bunkr_scrapper(safe_name, output_path.joinpath(safe_name), content_path).run([r.url for r in res])
\ No newline at end of file
+            prepare_bunkr_scrapper(
+                safe_name, output_path.joinpath(safe_name), content_path, self.html_parser, content_store,
+                max_workers=max_workers, request_cooldown=request_cooldown,
+                bandwidth_limiter=bandwidth_limiter, byte_budget=byte_budget, album_pool=album_pool,
+                http2=http2, mirror_pool=mirror_pool, thumbnails=thumbnails).run([r.url for r in res])
+
+        if mirror_pool is not None:
+            mirror_pool.start()
+        try:
+            if album_pool is None:
+                for name, res in results.items():
+                    download_album(name, res)
+                return
+            # Album threads only wait, the requests of every album run on the pool workers
+            with ThreadPoolExecutor(max_workers=parallel_albums) as albums:
+                for future in [albums.submit(download_album, name, res) for name, res in results.items()]:
+                    future.result()
+        finally:
+            if album_pool is not None:
+                album_pool.close()
+            if mirror_pool is not None:
+                mirror_pool.stop()
\ No newline at end of file
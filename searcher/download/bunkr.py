@@ -1,9 +1,60 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from typing import List, Union, Optional
 from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import re
 from scrapper import Scrapper, URLScrapper, FileDownloader
+from scrapper.utils import parses_only
+from scrapper.storage import ContentStore
+from scrapper.limits import ConcurrencyController, TokenBucket, ByteBudget, RateLimiter
+from scrapper.network import PooledSession, MirrorPool
 
+BUNKR_URL = "https://bunkrr.su"
 
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36",
+}
+
+
+@dataclass
+class AlbumPool:
+    """
+    Workers, connections and rate limit shared by albums downloaded at the same
+    time, so their total concurrency stays bounded.
+    """
+    executor: ThreadPoolExecutor
+    session: PooledSession
+    rate_limiter: RateLimiter
+    # HTTP/2 session for the pages, they use `session` if None
+    page_session: Optional[PooledSession] = None
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.session.close()
+        if self.page_session is not None:
+            self.page_session.close()
+
+
+def prepare_album_pool(max_workers: int = 16, request_cooldown: float = 0.8, http2: bool = False) -> AlbumPool:
+    return AlbumPool(
+        executor=ThreadPoolExecutor(max_workers=max_workers),
+        # Size probes and segments may use connections besides the shared workers
+        session=PooledSession(pool_maxsize=max_workers * 2, headers=REQUEST_HEADERS),
+        rate_limiter=RateLimiter(max_workers / request_cooldown if request_cooldown > 0 else None, max_workers),
+        page_session=PooledSession(pool_maxsize=max_workers, headers=REQUEST_HEADERS, http2=True) if http2 else None,
+    )
+
+
+def prepare_mirror_pool(mirrors: List[str], base_url: str = BUNKR_URL) -> MirrorPool:
+    """
+    Pool of the bunkr domains in mirrors and base_url, which is always one of them.
+    It has to be started before the scrappers using it run.
+    """
+    return MirrorPool([base_url] + [m for m in mirrors if m.rstrip("/") != base_url.rstrip("/")], headers=REQUEST_HEADERS)
+
+
+@parses_only(SoupStrainer("a"))
 def __find_all_image_page_links(soup: BeautifulSoup) -> List[str]:
     links = []
     for link in soup.find_all("a"):
@@ -14,6 +65,21 @@ def __find_all_image_page_links(soup: BeautifulSoup) -> List[str]:
     return links
 
 
+@parses_only(SoupStrainer("a"))
+def __find_all_thumbnail_links(soup: BeautifulSoup) -> List[str]:
+    links = []
+    for link in soup.find_all("a"):
+        if link.img is not None and link.img.get("src"):
+            links.append(link.img.get("src"))
+    if len(links) == 0:
+        raise Exception("No thumbnails found")
+    return links
+
+
+@parses_only(
+    SoupStrainer("div", class_=re.compile(r"\blightgallery\b")),
+    SoupStrainer("video"),
+)
 def __get_bunkrr_links(soup: BeautifulSoup) -> List[str]:
     gallery_div = soup.find("div", class_="lightgallery")
     if gallery_div is None:
@@ -24,48 +90,123 @@ def __get_bunkrr_links(soup: BeautifulSoup) -> List[str]:
     return [gallery_div.img.get("src")]
 
 
-def prepare_bunkr_scrapper(name: str, output_path: Path, content_path: Optional[Path]) -> Scrapper:
+def prepare_bunkr_scrapper(
+        name: str, output_path: Path, content_path: Optional[Path], html_parser: str = "lxml",
+        content_store: Optional[ContentStore] = None, adaptive_concurrency: bool = True,
+        base_url: str = BUNKR_URL, max_workers: int = 16, request_cooldown: float = 0.8,
+        bandwidth_limiter: Optional[TokenBucket] = None, byte_budget: Optional[ByteBudget] = None,
+        album_pool: Optional[AlbumPool] = None, engine: str = "threads", http2: bool = False,
+        mirror_pool: Optional[MirrorPool] = None, thumbnails: bool = False) -> Scrapper:
+    """
+    base_url, max_workers and request_cooldown default to the values used for bunkr,
+    a request_cooldown of 0 disables the rate limit.
+    With an album_pool the requests run on its workers, connections and rate limit, which should be
+    prepared with the same max_workers and request_cooldown.
+    engine: "threads", or "asyncio" to run max_workers requests per job from an event loop (needs aiohttp)
+    http2: multiplexes the page requests of the threaded engine over HTTP/2 connections (needs httpx[http2])
+    mirror_pool: started pool from prepare_mirror_pool, urls on any of its mirrors are requested from the fastest one
+    thumbnails: downloads only the thumbnails shown in the album pages, into a thumbnails directory,
+    without requesting the page of every file
+    """
+    if engine == "threads":
+        url_scrapper, file_downloader = URLScrapper, FileDownloader
+    elif engine == "asyncio":
+        from scrapper.aio import AsyncURLScrapper as url_scrapper, AsyncFileDownloader as file_downloader
+    else:
+        raise ValueError(f"Unknown engine {engine}, expected 'threads' or 'asyncio'")
+    if http2 and engine != "threads":
+        raise ValueError("HTTP/2 is only available with the threads engine")
+    if album_pool is not None and engine != "threads":
+        # The asyncio jobs don't run on the pool workers, so its bound wouldn't hold
+        raise ValueError("An album pool is only available with the threads engine")
+    shared = dict(executor=album_pool.executor, session=album_pool.session, rate_limiter=album_pool.rate_limiter,
+                  page_session=album_pool.page_session) if album_pool is not None else dict()
+    def concurrency() -> Optional[ConcurrencyController]:
+        return ConcurrencyController(min_limit=min(2, max_workers), max_limit=max_workers) if adaptive_concurrency else None
+
     content_download_path = output_path.joinpath(content_path) if content_path is not None else output_path
+    if thumbnails:
+        content_download_path = content_download_path.joinpath("thumbnails")
     content_download_path.mkdir(parents=True,exist_ok=True)
 
-    return Scrapper(
-        [
-            URLScrapper(
+    if thumbnails:
+        jobs = [
+            url_scrapper(
+                __find_all_thumbnail_links,
+                description="Fetching thumbnails",
+                concurrency=concurrency(),
+                connections=max_workers,
+                save_stats=True,
+                name="Find thumbnails",
+                stats_output_dir=f"{output_path}"
+            ),
+            file_downloader(
+                dir=f"{content_download_path}",
+                file_timeout=120,
+                name="Download thumbnails",
+                basename="thumbnail",
+                content_store=content_store,
+                concurrency=concurrency(),
+                connections=max_workers,
+                bandwidth_limiter=bandwidth_limiter,
+                byte_budget=byte_budget,
+                save_stats=True,
+                stats_output_dir=f"{output_path}"
+            ),
+        ]
+    else:
+        jobs = [
+            url_scrapper(
                 __find_all_image_page_links,
                 description="Fetching pages",
+                concurrency=concurrency(),
+                connections=max_workers,
                 save_stats=True,
                 name="Find pages",
                 stats_output_dir=f"{output_path}"
                 # stats_filepath=f"{output_path}/pages-stats.json",
             ),
             # URLProcessor(write_page_links),
-            URLScrapper(
+            url_scrapper(
                 __get_bunkrr_links,
                 description="Fetching file links",
+                concurrency=concurrency(),
+                connections=max_workers,
                 save_stats=True,
                 name="Find files",
                 stats_output_dir=f"{output_path}"
                 # stats_filepath=f"{output_path}/images-stats.json",
             ),
             # URLProcessor(write_image_links),
-            FileDownloader(
+            file_downloader(
                 dir=f"{content_download_path}",
                 file_timeout=120,
                 name="Download files",
                 basename="result",
+                content_store=content_store,
+                concurrency=concurrency(),
+                connections=max_workers,
+                bandwidth_limiter=bandwidth_limiter,
+                byte_budget=byte_budget,
                 save_stats=True,
                 stats_output_dir=f"{output_path}"
                 # stats_filepath=f"{output_path}/download-stats.json",
             ),
-        ],
+        ]
+
+    return Scrapper(
+        jobs,
         name=name,
-        base_url="https://bunkrr.su",
-        sparse_requests=True,
-        request_cooldown=0.8,
+        html_parser=html_parser,
+        base_url=base_url,
+        sparse_requests=request_cooldown > 0,
+        request_cooldown=request_cooldown,
         request_timeout=10,
         log_path=output_path,
-        request_headers={
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36",
-        },
-        max_workers=16,
+        request_headers=REQUEST_HEADERS,
+        max_workers=max_workers,
+        pipelined=True,
+        http2=http2,
+        mirror_pool=mirror_pool,
+        **shared,
     )
\ No newline at end of file
@@ -7,8 +7,13 @@ setup(
     install_requires=[
         'tqdm',
         'bs4',
+        'lxml',
         'requests'
     ],
+    extras_require={
+        'asyncio': ['aiohttp'],
+        'http2': ['httpx[http2]'],
+    },
     entry_points={
         'console_scripts': [
             'searcher = searcher.main:main',